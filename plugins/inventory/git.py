@@ -5,28 +5,50 @@ from __future__ import (absolute_import, division, print_function)
 import argparse
 import copy
 import configparser
+from collections import ChainMap
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from distutils.util import strtobool
 import getpass
+import fcntl
 import git
 import giturlparse
+import hashlib
 import json
+import mmap
 import os
+import posixpath
 import re
+import struct
+import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
 import time
 import yaml
 from shutil import rmtree
+from types import MappingProxyType
 from ansible.errors import AnsibleError, AnsibleParserError
 from ansible.module_utils.six import string_types
-from ansible.module_utils._text import to_native, to_text
+from ansible.module_utils._text import to_bytes, to_native, to_text
 from ansible.module_utils.common._collections_compat import MutableMapping
+from ansible.parsing.vault import VaultLib, VaultSecret, is_encrypted
 from ansible.parsing.yaml.dumper import AnsibleDumper
-from ansible.plugins.inventory import BaseInventoryPlugin
+from ansible.parsing.yaml.objects import AnsibleVaultEncryptedUnicode
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable
+from ansible.utils.vars import combine_vars
 
 __metaclass__ = type
 
 NoneType = type(None)
 
+# module name of the command line entry point, run with python -m
+CLI_MODULE_NAME = 'ansible_collections.spatiumcepa.platform.plugins.inventory.git'
+
+# libyaml is several times faster at parsing inventory files when PyYAML was built with it
+YAML_SAFE_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 DOCUMENTATION = '''
     name: spatiumcepa.platform.git
     version_added: "2.10"
@@ -36,6 +58,11 @@ DOCUMENTATION = '''
         - arbitrary YAML files can define ansible variables, host groups, and include other files that do the same
     notes:
         - !vault inline encrypted variables will NOT be decrypted, allowing it to be done at playbook run time instead of during inventory aggregation
+        - when cache is enabled, the built inventory is cached keyed on the resolved git commit SHA, file_path and plugin options
+        - cache is only used when git_url is set, local working copy files have no commit to key the cache on
+        - an inventory that reads include_vars files vault encrypted as a whole is never cached, as it holds their decrypted content
+    extends_documentation_fragment:
+        - inventory_cache
     options:
         plugin:
             description: indicates this is a configuration of the spatiumcepa.platform.git plugin
@@ -51,13 +78,138 @@ DOCUMENTATION = '''
             description: Git commit, branch, or tag to check out
             default: master
         git_repo_cache_dir:
-            description: Where to store the repository clones
+            description:
+                - Where to store the repository clones
+                - each git_url gets a bare mirror repository and immutable per commit snapshots of its files,
+                  shared safely between concurrent inventory loads through file locks
         git_repo_cache_update_time_seconds:
-            description: How old should the repo cache get before being refreshed
+            description:
+                - How old should the repo cache get before being refreshed
+                - refreshing checks the commit ref on the remote with ls-remote and only fetches when it has moved
             type: int
             default: 3600
+        git_repo_cache_stale_while_revalidate:
+            description:
+                - When the repo cache is older than git_repo_cache_update_time_seconds,
+                  use the cached commit right away and refresh the repo cache in a background process
+                - the background process runs C(python -m ansible_collections.spatiumcepa.platform.plugins.inventory.git refresh)
+                - the refreshed commit is used by the next inventory load
+                - errors of the background process are written to a C(refresh-*.log) file in the repo cache and shown at C(-vvvv),
+                  a warning is shown once the repo cache is 10 times git_repo_cache_update_time_seconds old
+                - a commit not in the repo cache yet is always fetched before loading
+            type: bool
+            default: False
         delete_repo_cache:
-            description: Should the repository cache be deleted before cloning any repositories?
+            description:
+                - Should the repository cache be deleted before cloning any repositories?
+                - a repository cache another inventory load is reading is left in place
+            type: bool
+            default: False
+        populate_mode:
+            description:
+                - C(build) builds the whole inventory as a dictionary, then adds the dictionary to the Ansible inventory
+                - C(direct) adds groups, their children, hosts and variables to the Ansible inventory while reading the inventory files,
+                  without the dictionary and a second pass over it
+                - C(direct) keeps a record of what each host group definition added, to undo it when the group is defined again,
+                  so it uses about as much memory and time as C(build)
+                - with either mode, the last definition of a host group defined more than once replaces earlier ones
+                - C(build) is always used when cache is enabled, as the cache stores the built dictionary
+            type: str
+            default: build
+            choices: ['build', 'direct']
+        prefetch_workers:
+            description:
+                - Before building the inventory, discover every file reachable from file_path through includes and include_vars
+                  and read and parse them concurrently with this many threads
+                - reading is what runs concurrently, which helps most with slow file systems such as NFS and with vault encrypted files
+                - files are read and parsed one at a time as the inventory is built when set to 0
+            type: int
+            default: 0
+        vault_decrypt_workers:
+            description:
+                - Decrypt include_vars files that are vault encrypted as a whole in this many processes while prefetching,
+                  so files are decrypted on several CPU cores
+                - only applies when prefetch_workers is set
+                - secrets are passed to the worker processes in memory, decrypted content is never written to disk
+            type: int
+            default: 0
+        incremental_rebuild:
+            description:
+                - Record how each inventory file of a git_url source was built, next to the repository mirror in git_repo_cache_dir,
+                  and when commit moves only build again the inventory files changed between the recorded commit and commit,
+                  and the files including them, replaying the recorded build of every other file
+                - include_vars files are always read again, so a change to one needs no rebuild
+                - only applies to populate_mode C(build)
+            type: bool
+            default: False
+        incremental_rebuild_verify:
+            description: Also build the inventory from scratch after an incremental rebuild and fail if the two differ
+            type: bool
+            default: False
+        compiled_inventory_path:
+            description:
+                - Load an inventory compiled with the compile command of this plugin instead of reading git_url,
+                  without cloning the repository or reading any inventory files
+                - git_url, commit, file_path and sources are only used to compile the inventory when this is set
+                - compile with C(python -m ansible_collections.spatiumcepa.platform.plugins.inventory.git compile CONFIG)
+            type: path
+        sources:
+            description:
+                - Load several inventory files into one inventory, instead of the single git_url, commit, file_path and ssh_key
+                - each source is a dictionary with file_path and optionally git_url, commit and ssh_key,
+                  commit and ssh_key default to the commit and ssh_key options
+                - repositories of all sources are updated concurrently, then sources are added to the inventory in the order listed,
+                  a variable set by more than one source on the same group or host takes the value of the last of them
+                - mutually exclusive with git_url
+            type: list
+            elements: dict
+        source_workers:
+            description: How many sources to update concurrently
+            type: int
+            default: 4
+        persist_parse_cache:
+            description:
+                - Persist parsed inventory and variable files in git_repo_cache_dir keyed by their git blob SHA,
+                  so files unchanged between runs are not parsed again
+                - parsed files are always memoized in memory by content for the life of the process
+                - files that are vault encrypted as a whole are never persisted
+            type: bool
+            default: False
+        profile_path:
+            description:
+                - Append a JSON line profiling each inventory load to this file,
+                  with the time spent cloning, fetching, checking out, parsing each file, building and populating
+                - phases nest, building includes the time to parse the files it reads
+            type: path
+            env:
+                - name: ANSIBLE_INVENTORY_GIT_PROFILE
+        git_repo_cache_snapshot_max_age_seconds:
+            description: How long a commit snapshot can go unused before it is removed from the repo cache
+            type: int
+            default: 604800
+        git_read_mode:
+            description:
+                - How inventory and variable files are read from the repository clone
+                - C(checkout) checks out commit to a snapshot directory in the repository cache and reads files from it
+                - C(objects) reads files as blobs at commit from the git object database without checking out a working tree,
+                  so configurations pinned to different commits can share one repository cache
+            type: str
+            default: checkout
+            choices: ['checkout', 'objects']
+        git_clone_depth:
+            description:
+                - Shallow clone and fetch commit with history truncated to this many commits
+                - full history of commit is fetched when not set
+            type: int
+        git_clone_filter:
+            description:
+                - Partial clone filter spec such as C(blob:none), blobs not needed to read the inventory are never downloaded
+                - the git server must allow filtering with uploadpack.allowFilter
+            type: str
+        git_sparse_checkout:
+            description:
+                - Only check out the directories of file_path and the files it reaches through includes and include_vars
+                - only applies to git_read_mode C(checkout)
             type: bool
             default: False
 '''
@@ -70,23 +222,254 @@ git_url: git@github.com:spatium-cepa/customer-configuration.git
 commit: master
 file_path: platforms/cloud.yml
 delete_repo_cache: false
+# read files from the git object database at commit instead of checking out the repository cache working tree
+git_read_mode: objects
+# shallow partial clone that only downloads the blobs of files the inventory reads
+git_clone_depth: 1
+git_clone_filter: blob:none
+# use the cached commit right away when the repo cache is stale and refresh it in the background
+git_repo_cache_stale_while_revalidate: true
+# cache the built inventory, keyed on the checked out commit SHA
+cache: true
+cache_plugin: jsonfile
+cache_connection: /tmp/ansible-inventory-git-inventory-cache
 # load working copy file without checking out git repo by only specifying file path
 # file_path: /home/nkiraly/src/spatium-cepa/customer-configuration/platforms/cloud.yml
+# or load several repositories into one inventory, fetched concurrently
+# sources:
+#   - git_url: git@github.com:spatium-cepa/customer-configuration.git
+#     file_path: platforms/cloud.yml
+#   - git_url: git@github.com:spatium-cepa/platform-configuration.git
+#     commit: v1
+#     file_path: platforms/shared.yml
+#     ssh_key: ~/.ssh/platform_configuration
 '''
 
 
-class InventoryModule(BaseInventoryPlugin):  # TODO: implement Cacheable
+def _decrypt_in_vault_worker(vault_secrets, b_vault_data, b_file_name):
+    # run in vault_decrypt_workers processes, decrypting with VaultLib as DataLoader.load_from_file does
+    return VaultLib(vault_secrets).decrypt(b_vault_data, filename=b_file_name)
+
+
+class InventoryIndex:
+    ''' Host and group lookups over a built inventory dictionary, indexed once so each query does not walk every group.
+        Variables follow the same inheritance and precedence as the Ansible inventory the plugin populates:
+        group vars from the least to the most specific group, ordered by depth, ansible_group_priority and name, then host vars.
+    '''
+
+    def __init__(self, inventory, expand_host_pattern):
+        ''' :arg inventory: inventory dictionary as built by the plugin, with vars, children and hosts of each group
+            :arg expand_host_pattern: callable returning the host names and port of a host pattern
+        '''
+        self.inventory = inventory
+        self._group_vars = {'all': {}, 'ungrouped': {}}
+        self._group_priorities = {}
+        self._group_parents = {'all': [], 'ungrouped': []}
+        self._group_children = {'all': [], 'ungrouped': []}
+        self._group_hosts = {'all': [], 'ungrouped': []}
+        self._host_groups = {}
+        self._own_host_vars = {}
+        self._group_ancestors = {}
+        self._group_depths = {}
+        self._host_vars = {}
+
+        # one pass in the order the plugin populates the inventory, so host vars set by several groups resolve the same way
+        for group_name, group_data in inventory.items():
+            self._index_group(group_name, group_data, expand_host_pattern)
+        for group_name, group_parents in self._group_parents.items():
+            if not group_parents and group_name != 'all':
+                self._add_child('all', group_name)
+        for host, host_groups in self._host_groups.items():
+            if not host_groups:
+                self._add_host('ungrouped', host)
+
+    def _index_group(self, group_name, group_data, expand_host_pattern):
+        self._add_group(group_name)
+        if not isinstance(group_data, MutableMapping):
+            return
+        for key, section in group_data.items():
+            if isinstance(section, string_types):
+                section = {section: None}
+            elif isinstance(section, list):
+                section = dict.fromkeys(section, None)
+            if not isinstance(section, MutableMapping):
+                continue
+            if key == 'vars':
+                for var_name, var_value in section.items():
+                    if var_name == 'ansible_group_priority':
+                        self._group_priorities[group_name] = int(var_value)
+                    else:
+                        self._group_vars[group_name] = self._set_variable(self._group_vars[group_name], var_name, var_value)
+            elif key == 'children':
+                for child_name, child_data in section.items():
+                    self._index_group(child_name, child_data, expand_host_pattern)
+                    self._add_child(group_name, child_name)
+            elif key == 'hosts':
+                for host_pattern, host_data in section.items():
+                    hosts, port = expand_host_pattern(host_pattern)
+                    for host in hosts:
+                        self._add_host(group_name, host)
+                        if port:
+                            self._own_host_vars[host] = self._set_variable(self._own_host_vars[host], 'ansible_port', port)
+                        for var_name, var_value in (host_data or {}).items():
+                            self._own_host_vars[host] = self._set_variable(self._own_host_vars[host], var_name, var_value)
+
+    def _set_variable(self, variables, var_name, var_value):
+        # mappings set twice are combined the way Host.set_variable and Group.set_variable do
+        if var_name in variables and isinstance(variables[var_name], MutableMapping) and isinstance(var_value, MutableMapping):
+            return combine_vars(variables, {var_name: var_value})
+        variables[var_name] = var_value
+        return variables
+
+    def _add_group(self, group_name):
+        if group_name not in self._group_vars:
+            self._group_vars[group_name] = {}
+            self._group_parents[group_name] = []
+            self._group_children[group_name] = []
+            self._group_hosts[group_name] = []
+
+    def _add_child(self, group_name, child_name):
+        if child_name not in self._group_children[group_name]:
+            self._group_children[group_name].append(child_name)
+            self._group_parents[child_name].append(group_name)
+
+    def _add_host(self, group_name, host):
+        host_groups = self._host_groups.setdefault(host, [])
+        self._own_host_vars.setdefault(host, {})
+        if group_name not in host_groups:
+            host_groups.append(group_name)
+            self._group_hosts[group_name].append(host)
+
+    @property
+    def hosts(self):
+        ''' names of all hosts '''
+        return list(self._host_groups)
+
+    @property
+    def groups(self):
+        ''' names of all groups, including all and ungrouped '''
+        return list(self._group_vars)
+
+    def groups_of(self, host):
+        ''' groups host is directly a member of '''
+        self._check_host(host)
+        return list(self._host_groups[host])
+
+    def group_ancestors(self, group_name):
+        ''' every group group_name is a descendant of, all included '''
+        if group_name not in self._group_ancestors:
+            if group_name not in self._group_parents:
+                raise AnsibleError(f"Group {group_name} not found in inventory")
+            group_ancestors = set()
+            for parent_name in self._group_parents[group_name]:
+                group_ancestors.add(parent_name)
+                group_ancestors.update(self.group_ancestors(parent_name))
+            self._group_ancestors[group_name] = frozenset(group_ancestors)
+        return self._group_ancestors[group_name]
+
+    def group_depth(self, group_name):
+        ''' length of the longest path from all to group_name, as the Ansible inventory computes group depth '''
+        if group_name not in self._group_depths:
+            self._group_depths[group_name] = max([self.group_depth(parent_name) + 1 for parent_name in self._group_parents[group_name]] or [0])
+        return self._group_depths[group_name]
+
+    def host_groups(self, host):
+        ''' every group host belongs to directly or through children, from the least to the most specific '''
+        group_names = set(self.groups_of(host))
+        for group_name in self._host_groups[host]:
+            group_names.update(self.group_ancestors(group_name))
+        return sorted(group_names, key=lambda group_name: (self.group_depth(group_name), self._group_priorities.get(group_name, 1), group_name))
+
+    def host_vars(self, host):
+        ''' effective variables of host, computed on first use and shared between calls, so they must not be modified '''
+        if host not in self._host_vars:
+            self._check_host(host)
+            host_vars = {}
+            for group_name in self.host_groups(host):
+                host_vars = combine_vars(host_vars, self._group_vars[group_name])
+            self._host_vars[host] = combine_vars(host_vars, self._own_host_vars[host])
+        return self._host_vars[host]
+
+    def list_inventory(self):
+        ''' the inventory in the layout of ansible-inventory --list '''
+        inventory_list = {}
+        self._list_group('all', inventory_list)
+        inventory_list['_meta'] = {'hostvars': dict((host, self.host_vars(host)) for host in sorted(self._host_groups) if self.host_vars(host))}
+        return inventory_list
+
+    def _list_group(self, group_name, inventory_list):
+        group_list = {}
+        if group_name != 'all' and self._group_hosts[group_name]:
+            group_list['hosts'] = sorted(self._group_hosts[group_name])
+        child_names = sorted(self._group_children[group_name])
+        if child_names:
+            group_list['children'] = child_names
+        if group_list:
+            inventory_list[group_name] = group_list
+        for child_name in child_names:
+            if child_name not in inventory_list:
+                self._list_group(child_name, inventory_list)
+
+    def _check_host(self, host):
+        if host not in self._host_groups:
+            raise AnsibleError(f"Host {host} not found in inventory")
+
+
+class InventoryModule(BaseInventoryPlugin, Cacheable):
 
     NAME = 'spatiumcepa.platform.git'
 
     ANSIBLE_INVENTORY_GIT_HOST_TYPE = '_aig_type'
 
+    # bump when the cached inventory structure changes so old entries are not reused
+    ANSIBLE_INVENTORY_GIT_CACHE_VERSION = 1
+
+    # first bytes of a compiled inventory snapshot file
+    ANSIBLE_INVENTORY_GIT_SNAPSHOT_MAGIC = b'AIGSNAP\n'
+
+    # plugin options that change the built inventory and so are part of the cache key
+    ANSIBLE_INVENTORY_GIT_CACHE_KEY_OPTIONS = ('git_url', 'commit', 'file_path')
+
+    # warn when background refreshes have left the repo cache this many git_repo_cache_update_time_seconds behind
+    ANSIBLE_INVENTORY_GIT_STALE_WARNING_UPDATE_TIMES = 10
+
     def __init__(self):
 
         super(InventoryModule, self).__init__()
 
         self._options = {}
         self._vars = {}
+        # parsed files by content hash, kept across sources and inventory refreshes
+        self._parse_cache = {}
+        # parse cache keys of files that were vault encrypted as a whole
+        self._decrypted_parse_cache_keys = set()
+        self._read_decrypted_file = False
+        self._phase_timings = {}
+        self._file_timings = []
+        self._file_hashes = {}
+        self._include_stack = []
+        # what the current definition of each host group read by populate_mode direct added to the Ansible inventory,
+        # so a group defined again can undo it, with the definitions giving each host, the host variables they replaced
+        # from before the load and the groups and hosts the load created
+        self._direct_definitions = {}
+        self._direct_host_definitions = {}
+        self._direct_host_vars_before = {}
+        self._direct_created_groups = set()
+        self._direct_created_hosts = set()
+        # child groups that would make a loop until a group defined again further on breaks it
+        self._direct_pending_children = []
+        # GitPython shares one git cat-file process per repository, which must not be used from two threads at once
+        self._git_lock = threading.Lock()
+        self._timings_lock = threading.Lock()
+        self._vault_decrypt_executor = None
+        self._vault_decrypt_secrets = None
+        self._compiling = False
+        self._inventory_index = None
+        # shared locks on the repository caches this load reads, shared with the copies for sources
+        self._cache_read_locks = []
+        self._recording_build = False
+        self._build_ops = None
+        self._previous_build = None
 
     def verify_file(self, path):
         ''' return true/false if this is possibly a valid file for this plugin to consume '''
@@ -117,12 +500,28 @@ class InventoryModule(BaseInventoryPlugin):  # TODO: implement Cacheable
         # call base method to ensure properties are available for use with other helper methods
         super(InventoryModule, self).parse(self.inventory, self.loader, path, cache)
 
+        self._configure(path)
+        try:
+            with self._timed('total'):
+                if self.compiled_inventory_path:
+                    self._load_compiled_inventory()
+                elif self.sources:
+                    self._load_sources(path, cache)
+                else:
+                    self._load_inventory(path, cache)
+        finally:
+            self._release_cache_read_locks()
+            if self.profile_path:
+                self._write_profile(path)
+
+    def _configure(self, path):
         # this method will parse 'common format' inventory sources and
         # update any options declared in DOCUMENTATION as needed
-        config = self._read_config_data(path)
+        self._read_config_data(path)
 
-        self.debug = False
         self._git_repo_path = None
+        self._git_commit = None
+        self._git_object_reads = False
 
         self.log("start processing options")
         self.ssh_key = self.get_option('ssh_key')
@@ -135,189 +534,1323 @@ class InventoryModule(BaseInventoryPlugin):  # TODO: implement Cacheable
         if self.get_option('git_repo_cache_dir') is not None:
             self.git_repo_cache_dir = self.get_option('git_repo_cache_dir')
         self.git_repo_cache_update_time_seconds = self.get_option('git_repo_cache_update_time_seconds')
+        self.git_repo_cache_stale_while_revalidate = self.get_option('git_repo_cache_stale_while_revalidate')
+        self.git_repo_cache_snapshot_max_age_seconds = self.get_option('git_repo_cache_snapshot_max_age_seconds')
+        self.persist_parse_cache = self.get_option('persist_parse_cache')
+        self.populate_mode = self.get_option('populate_mode')
+        self.git_read_mode = self.get_option('git_read_mode')
+        self.git_clone_depth = self.get_option('git_clone_depth')
+        self.git_clone_filter = self.get_option('git_clone_filter')
+        self.git_sparse_checkout = self.get_option('git_sparse_checkout')
+        self.profile_path = self.get_option('profile_path')
+        self.prefetch_workers = self.get_option('prefetch_workers')
+        self.vault_decrypt_workers = self.get_option('vault_decrypt_workers')
+        self.sources = self.get_option('sources')
+        self.source_workers = self.get_option('source_workers')
+        if self.sources and self.git_url is not None:
+            raise AnsibleParserError(f"git_url and sources are mutually exclusive in {path}")
+        self.compiled_inventory_path = self.get_option('compiled_inventory_path')
+        self.incremental_rebuild = self.get_option('incremental_rebuild')
+        self.incremental_rebuild_verify = self.get_option('incremental_rebuild_verify')
         self.log("finish processing options")
 
+        self._phase_timings = {}
+        self._file_timings = []
+        # file paths do not change content within one inventory load
+        self._file_hashes = {}
+        self._include_stack = []
+        self._source_plugins = []
+
+    def _load_inventory(self, path, cache):
+        self._update_source()
+        self._populate_source(path, cache)
+
+    def _load_sources(self, path, cache):
+        # every source is handled by its own copy of this plugin, sharing the inventory, loader, caches and profile
+        source_plugins = [self._copy_for_source(source) for source in self.sources]
+        self._source_plugins = source_plugins
+        self.log("Updating %s sources with %s workers", len(source_plugins), self.source_workers)
+        with ThreadPoolExecutor(max_workers=self.source_workers) as executor:
+            update_futures = [executor.submit(source_plugin._update_source) for source_plugin in source_plugins]
+            for update_future in update_futures:
+                update_future.result()
+        # sources are populated in the order they are listed, so later sources win when they set the same variable
+        for source_plugin in source_plugins:
+            source_plugin._populate_source(path, cache)
+
+    def _copy_for_source(self, source):
+        if not isinstance(source, MutableMapping) or not source.get('file_path'):
+            raise AnsibleParserError(f"Invalid source, expected a dictionary with at least file_path and got: {to_native(source)}")
+        unknown_source_options = set(source) - set(('git_url', 'commit', 'file_path', 'ssh_key'))
+        if unknown_source_options:
+            raise AnsibleParserError(f"Invalid source options {', '.join(sorted(unknown_source_options))} for source {source['file_path']}")
+        source_plugin = copy.copy(self)
+        source_plugin.git_url = source.get('git_url')
+        source_plugin.commit = source.get('commit', self.commit)
+        source_plugin.file_path = source['file_path']
+        source_plugin.ssh_key = source.get('ssh_key', self.ssh_key)
+        source_plugin.sources = None
+        source_plugin._git_repo_path = None
+        source_plugin._git_commit = None
+        source_plugin._git_object_reads = False
+        # file paths are only unique within one repository
+        source_plugin._file_hashes = {}
+        source_plugin._include_stack = []
+        source_plugin._git_lock = threading.Lock()
+        return source_plugin
+
+    def _update_source(self):
         # by default, use local file_path
-        inventory_file_path = self.file_path
+        self._inventory_file_path = self.file_path
 
         # if git_url specified, check out the repo and use file_path in repo check out
         if self.git_url is not None:
-            self.log(f"git_url is {self.git_url}")
+            self.log("git_url is %s", self.git_url)
             self._update_repository()
-            inventory_file_path = os.path.join(self._git_repo_path, self.file_path)
-            if not os.path.isfile(inventory_file_path):
-                raise IOError(f"Inventory file '{self.file_path}' not found in repository at {inventory_file_path}")
+            self._git_object_reads = self.git_read_mode == 'objects'
+            if self._git_object_reads:
+                # file paths are relative to the repository root when reading from the object database
+                self._inventory_file_path = posixpath.normpath(self.file_path)
+                if not self._repository_file_exists(self._inventory_file_path):
+                    raise IOError(f"Inventory file '{self.file_path}' not found in repository at commit {self._git_commit.hexsha}")
+            else:
+                self._inventory_file_path = os.path.join(self._git_repo_path, self.file_path)
+                if not os.path.isfile(self._inventory_file_path):
+                    raise IOError(f"Inventory file '{self.file_path}' not found in repository at {self._inventory_file_path}")
 
+    def _populate_source(self, path, cache):
+        inventory_file_path = self._inventory_file_path
         inventory_name = os.path.basename(inventory_file_path).split('.')[0]
+        self._include_stack = [os.path.normpath(inventory_file_path)]
 
-        # initialize inventory dictionary to populate to spec minimum
-        inventory_yaml_dict = {}
+        # the inventory cache is keyed on the checked out commit, so only a git_url source can use it
+        user_cache_setting = self.get_option('cache') and self.git_url is not None
+        attempt_to_read_cache = user_cache_setting and cache
+        cache_needs_update = user_cache_setting and not cache
+
+        inventory_yaml_dict = None
+        if user_cache_setting:
+            cache_key = self._get_inventory_cache_key(path)
+        if attempt_to_read_cache:
+            try:
+                inventory_yaml_dict = self._from_cacheable(self._cache[cache_key])
+                self.log("inventory cache hit for %s", cache_key)
+            except KeyError:
+                self.log("inventory cache miss for %s", cache_key)
+                cache_needs_update = True
+
+        if inventory_yaml_dict is None and self.populate_mode == 'direct' and not user_cache_setting:
+            self._prefetch_include_graph(inventory_file_path)
+            self.log("start populating inventory")
+            with self._timed('populate'):
+                self._populate_direct(inventory_file_path, inventory_name)
+            self.log("finish populating inventory")
+            return
+
+        if inventory_yaml_dict is None:
+            inventory_yaml_dict = self._build_source_inventory(inventory_file_path, inventory_name)
+
+        if cache_needs_update:
+            if self._read_decrypted_file:
+                # the decrypted content of files vault encrypted as a whole must never be persisted
+                self.log("Not caching inventory %s, it holds the content of a vault encrypted file", cache_key)
+            else:
+                self._cache[cache_key] = self._to_cacheable(inventory_yaml_dict)
+
+        with self._timed('populate'):
+            self._populate(inventory_yaml_dict)
+
+    def _build_source_inventory(self, inventory_file_path, inventory_name):
+        self._read_decrypted_file = False
+        self._recording_build = self.incremental_rebuild and self.git_url is not None
+        self._build_ops = None
+        self._build_files = {}
+        self._reusable_builds = {}
+        self._previous_build = self._read_build_record() if self._recording_build else None
+        # reading every file up front would defeat reusing the recorded build
+        if self._previous_build is None:
+            self._prefetch_include_graph(inventory_file_path)
 
-        inventory_tree = self._read_inventory_file(inventory_file_path)
         self.log("start building inventory")
-        inventory_yaml_dict = self._build_inventory(
-            inventory_file_path=inventory_file_path,
-            inventory=inventory_yaml_dict,
-            parent=inventory_tree,
-            parent_name=inventory_name
-        )
+        with self._timed('build'):
+            inventory_yaml_dict = self._flatten_group_vars(self._build_file(inventory_file_path, {}, inventory_name))
         self.log("finish building inventory")
-        self.log(self._yaml_format_dict(inventory_yaml_dict))
-
-        # TODO: flag parse yaml dict modality ?
-        # where builder code does add_host / add_child / set_variable directly ?
-        # will this break vault encrypted variables?
-        if True:
-            if isinstance(inventory_yaml_dict, MutableMapping):
-                for group_name in inventory_yaml_dict:
-                    self._parse_group(group_name, inventory_yaml_dict[group_name])
-            else:
-                raise AnsibleParserError("Invalid inventory data, expected dictionary and got:\n\n%s" % to_native(data))
 
-    def log(self, msg):
-        # TODO: self.display.vvvv why u no?
-        if self.debug:
-            fh = open("git-inventory.log", "a")
-            fh.write(msg + u'\n')
-            fh.close()
+        if self._previous_build is not None and self.incremental_rebuild_verify:
+            self._verify_incremental_build(inventory_file_path, inventory_name, inventory_yaml_dict)
+        if self._recording_build:
+            self._write_build_record()
+        if self._log_enabled():
+            self.log(self._yaml_format_dict(inventory_yaml_dict))
+        return inventory_yaml_dict
+
+    def _get_build_record_path(self):
+        return os.path.join(self._git_cache_path, 'builds', f"{hashlib.sha1(to_bytes(self.file_path)).hexdigest()[:12]}.json")
+
+    def _read_build_record(self):
+        # the build recorded for file_path at an earlier commit, with the paths changed since then
+        try:
+            with open(self._get_build_record_path(), 'r') as bfh:
+                build_record = self._from_cacheable(json.load(bfh))
+        except (IOError, ValueError):
+            self.log("No recorded build of %s, building all files", self.file_path)
+            return None
+        if build_record.get('version') != self.ANSIBLE_INVENTORY_GIT_CACHE_VERSION or build_record.get('file_path') != self.file_path:
+            return None
+        if build_record['commit_sha'] == self._git_commit.hexsha:
+            build_record['changed_paths'] = set()
+        else:
+            build_record['changed_paths'] = self._find_changed_paths(build_record['commit_sha'])
+            if build_record['changed_paths'] is None:
+                return None
+        self.log("Rebuilding %s from its build at commit %s, %s paths changed", self.file_path, build_record['commit_sha'],
+                 len(build_record['changed_paths']))
+        return build_record
+
+    def _find_changed_paths(self, previous_commit_sha):
+        # only trees are compared, so no blobs are needed even from a partial clone
+        try:
+            with self._git_lock:
+                changed_paths = self._git_commit.repo.git.diff('--name-only', '--no-renames', '-z', previous_commit_sha, self._git_commit.hexsha)
+        except git.GitCommandError as e:
+            self.log("Unable to diff recorded build commit %s, building all files: %s", previous_commit_sha, to_native(e))
+            return None
+        return set(changed_path for changed_path in changed_paths.split('\0') if changed_path)
+
+    def _write_build_record(self):
+        build_record = {
+            'version': self.ANSIBLE_INVENTORY_GIT_CACHE_VERSION,
+            'git_url': self.git_url,
+            'file_path': self.file_path,
+            'commit_sha': self._git_commit.hexsha,
+            'files': self._build_files,
+        }
+        # only builds that round trip through JSON unchanged are recorded, YAML dates or integer keys are not
+        if not self._is_json_safe(build_record):
+            self.log("Not recording build of %s, it cannot be stored as JSON", self.file_path)
+            return
+        build_record_path = self._get_build_record_path()
+        os.makedirs(os.path.dirname(build_record_path), exist_ok=True)
+        build_record_write_path = f"{build_record_path}.write-{os.getpid()}-{threading.get_ident()}"
+        with open(build_record_write_path, 'w') as bfh:
+            json.dump(self._to_cacheable(build_record), bfh)
+        os.replace(build_record_write_path, build_record_path)
+
+    def _verify_incremental_build(self, inventory_file_path, inventory_name, inventory_yaml_dict):
+        previous_build, recording_build = self._previous_build, self._recording_build
+        self._previous_build, self._recording_build = None, False
+        try:
+            with self._timed('verify'):
+                full_inventory_yaml_dict = self._flatten_group_vars(self._build_file(inventory_file_path, {}, inventory_name))
+        finally:
+            self._previous_build, self._recording_build = previous_build, recording_build
+        # compared as JSON so group and host order count, and !vault values compare by ciphertext without decrypting
+        if json.dumps(self._to_cacheable(inventory_yaml_dict), default=repr) != json.dumps(self._to_cacheable(full_inventory_yaml_dict), default=repr):
+            raise AnsibleError(f"Incremental rebuild of {self.file_path} at commit {self._git_commit.hexsha} differs from a full rebuild")
+        self.log("Incremental rebuild of %s matches a full rebuild", self.file_path)
+
+    def compile_inventory(self, loader, path, output_dir=None, commit=None, file_path=None):
+        ''' Build the inventory of the config at path and write it as a compiled inventory snapshot
+            named by the resolved commit SHA, returns the snapshot file path
+            :arg loader: a DataLoader, only used to read the config
+            :arg path: path to a spatiumcepa.platform.git config with git_url
+            :arg output_dir: directory to write the snapshot to, compiled in git_repo_cache_dir by default
+            :arg commit: commit to compile instead of the config commit
+            :arg file_path: inventory file to compile instead of the config file_path
+        '''
+        self.loader = loader
+        self._configure(path)
+        if commit is not None:
+            self.commit = commit
+        if file_path is not None:
+            self.file_path = file_path
+        if self.git_url is None:
+            raise AnsibleError(f"Only a config with git_url can be compiled, {path} has none")
+        self._compiling = True
+        try:
+            inventory_yaml_dict = self._build_config_inventory()
+        finally:
+            self._release_cache_read_locks()
+
+        output_dir = output_dir or os.path.join(self.git_repo_cache_dir, 'compiled')
+        file_path_hash = hashlib.sha1(to_bytes(self.file_path)).hexdigest()[:12]
+        snapshot_path = os.path.join(output_dir, f"{self._git_commit.hexsha}-{file_path_hash}.inventory")
+        snapshot_header = {
+            'version': self.ANSIBLE_INVENTORY_GIT_CACHE_VERSION,
+            'time': time.time(),
+            'git_url': self.git_url,
+            'commit': self.commit,
+            'commit_sha': self._git_commit.hexsha,
+            'file_path': self.file_path,
+        }
+        self._check_compilable(inventory_yaml_dict)
+        os.makedirs(output_dir, exist_ok=True)
+        self._write_compiled_inventory(snapshot_path, snapshot_header, self._to_cacheable(inventory_yaml_dict))
+        return snapshot_path
+
+    def _check_compilable(self, inventory_yaml_dict):
+        # compiled inventories are stored as JSON, so a value YAML loads as another type, such as a date, cannot be compiled
+        for group_name, group in inventory_yaml_dict.items():
+            vars_owners = [(f"host group {group_name}", group.get('vars') or {})]
+            vars_owners += [(f"host {host_name} of host group {group_name}", host_vars or {}) for host_name, host_vars in (group.get('hosts') or {}).items()]
+            for vars_owner, owner_vars in vars_owners:
+                for var_name, var_value in owner_vars.items():
+                    if not isinstance(var_name, string_types) or not self._is_json_safe(var_value):
+                        raise AnsibleError(f"Unable to compile {self.file_path}: variable {var_name} of {vars_owner} holds a {type(var_value).__name__}, "
+                                           f"which a compiled inventory cannot store as JSON, quote it in the inventory to keep it as a string")
+        if not self._is_json_safe(inventory_yaml_dict):
+            raise AnsibleError(f"Unable to compile {self.file_path}: the inventory cannot be stored as JSON")
+
+    def load_inventory_index(self, loader, path):
+        ''' Load the inventory of the config at path, from its compiled_inventory_path when set, and index it for queries
+            :arg loader: a DataLoader, used to read the config and to decrypt vault encrypted files
+            :arg path: path to a spatiumcepa.platform.git config with git_url or file_path
+        '''
+        self.loader = loader
+        self._configure(path)
+        if self.compiled_inventory_path:
+            snapshot_header, inventory_data = self._read_compiled_inventory(self.compiled_inventory_path)
+            inventory_yaml_dict = self._from_cacheable(inventory_data)
+        elif self.sources:
+            raise AnsibleError(f"Only a config with git_url or file_path can be queried, {path} has sources")
+        else:
+            try:
+                inventory_yaml_dict = self._build_config_inventory()
+            finally:
+                self._release_cache_read_locks()
+        return self._get_inventory_index(inventory_yaml_dict)
+
+    def _build_config_inventory(self):
+        self._update_source()
+        inventory_name = os.path.basename(self._inventory_file_path).split('.')[0]
+        self._include_stack = [os.path.normpath(self._inventory_file_path)]
+        return self._build_source_inventory(self._inventory_file_path, inventory_name)
+
+    def _write_compiled_inventory(self, snapshot_path, snapshot_header, inventory_data):
+        # magic, then the header and the inventory as JSON documents each prefixed by their length,
+        # so the header can be read without loading the inventory
+        b_header = to_bytes(json.dumps(snapshot_header, sort_keys=True))
+        b_inventory = to_bytes(json.dumps(inventory_data, sort_keys=True, separators=(',', ':')))
+        snapshot_write_path = f"{snapshot_path}.write-{os.getpid()}"
+        with open(snapshot_write_path, 'wb') as sfh:
+            sfh.write(self.ANSIBLE_INVENTORY_GIT_SNAPSHOT_MAGIC)
+            sfh.write(struct.pack('>I', len(b_header)))
+            sfh.write(b_header)
+            sfh.write(struct.pack('>Q', len(b_inventory)))
+            sfh.write(b_inventory)
+        os.rename(snapshot_write_path, snapshot_path)
+
+    def _read_compiled_inventory(self, snapshot_path):
+        try:
+            with open(snapshot_path, 'rb') as sfh, mmap.mmap(sfh.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+                magic_length = len(self.ANSIBLE_INVENTORY_GIT_SNAPSHOT_MAGIC)
+                if snapshot[:magic_length] != self.ANSIBLE_INVENTORY_GIT_SNAPSHOT_MAGIC:
+                    raise AnsibleParserError(f"{snapshot_path} is not a compiled inventory")
+                offset = magic_length
+                header_length, = struct.unpack_from('>I', snapshot, offset)
+                offset += 4
+                snapshot_header = json.loads(snapshot[offset:offset + header_length])
+                offset += header_length
+                inventory_length, = struct.unpack_from('>Q', snapshot, offset)
+                offset += 8
+                if snapshot_header.get('version') != self.ANSIBLE_INVENTORY_GIT_CACHE_VERSION:
+                    raise AnsibleParserError(f"Compiled inventory {snapshot_path} has version {snapshot_header.get('version')}, "
+                                             f"expected {self.ANSIBLE_INVENTORY_GIT_CACHE_VERSION}, compile it again")
+                inventory_data = json.loads(snapshot[offset:offset + inventory_length])
+        except (OSError, ValueError, struct.error) as e:
+            raise AnsibleParserError(f"Unable to read compiled inventory {snapshot_path}: {to_native(e)}")
+        return snapshot_header, inventory_data
+
+    def _load_compiled_inventory(self):
+        with self._timed('load'):
+            snapshot_header, inventory_data = self._read_compiled_inventory(self.compiled_inventory_path)
+        self.log("Loading compiled inventory %s of %s %s at commit %s", self.compiled_inventory_path,
+                 snapshot_header['git_url'], snapshot_header['file_path'], snapshot_header['commit_sha'])
+        with self._timed('populate'):
+            self._populate(self._from_cacheable(inventory_data))
+
+    def _populate(self, inventory_yaml_dict):
+        if isinstance(inventory_yaml_dict, MutableMapping):
+            for group_name in inventory_yaml_dict:
+                self._parse_group(group_name, inventory_yaml_dict[group_name])
+        else:
+            raise AnsibleParserError("Invalid inventory data, expected dictionary and got:\n\n%s" % to_native(inventory_yaml_dict))
+
+    def _get_inventory_cache_key(self, path):
+        # key on the resolved commit SHA rather than the commit option, as a branch name moves
+        cache_key_data = {
+            'version': self.ANSIBLE_INVENTORY_GIT_CACHE_VERSION,
+            'commit_sha': self._get_commit_sha(),
+            'options': dict((option, getattr(self, option)) for option in self.ANSIBLE_INVENTORY_GIT_CACHE_KEY_OPTIONS),
+        }
+        cache_key_hash = hashlib.sha1(json.dumps(cache_key_data, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"{self.get_cache_key(path)}_{cache_key_hash}"
+
+    def _get_commit_sha(self):
+        return self._git_commit.hexsha
+
+    def _to_cacheable(self, data):
+        # convert !vault values to their ciphertext so any cache plugin can store them
+        # the ciphertext is kept, the values are never decrypted to be cached
+        if isinstance(data, AnsibleVaultEncryptedUnicode):
+            return {'__ansible_vault': to_text(data._ciphertext)}
+        if isinstance(data, MutableMapping):
+            return dict((key, self._to_cacheable(value)) for key, value in data.items())
+        if isinstance(data, list):
+            return [self._to_cacheable(value) for value in data]
+        return data
+
+    def _from_cacheable(self, data):
+        # restore !vault values from cache, attaching the loader vault as the YAML loader would
+        if isinstance(data, AnsibleVaultEncryptedUnicode):
+            data.vault = self.loader._vault
+            return data
+        if isinstance(data, MutableMapping):
+            if list(data.keys()) == ['__ansible_vault']:
+                vault_value = AnsibleVaultEncryptedUnicode(data['__ansible_vault'])
+                vault_value.vault = self.loader._vault
+                return vault_value
+            return dict((key, self._from_cacheable(value)) for key, value in data.items())
+        if isinstance(data, list):
+            return [self._from_cacheable(value) for value in data]
+        return data
+
+    def log(self, msg, *args):
+        # msg is only formatted with args when -vvvv shows it
+        if self._log_enabled():
+            self.display.vvvv(msg % args if args else msg)
+
+    def _log_enabled(self):
+        return self.display.verbosity >= 4
+
+    @contextmanager
+    def _timed(self, phase):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_phase_timing(phase, time.perf_counter() - phase_start)
+
+    def _add_phase_timing(self, phase, seconds):
+        with self._timings_lock:
+            phase_timing = self._phase_timings.setdefault(phase, {'count': 0, 'seconds': 0.0})
+            phase_timing['count'] += 1
+            phase_timing['seconds'] += seconds
+
+    def _write_profile(self, path):
+        profile = {
+            'time': time.time(),
+            'source': path,
+            'git_url': self.git_url,
+            'commit': self.commit,
+            'commit_sha': self._git_commit.hexsha if self._git_commit is not None else None,
+            'file_path': self.file_path,
+            'sources': [
+                {
+                    'git_url': source_plugin.git_url,
+                    'commit': source_plugin.commit,
+                    'commit_sha': source_plugin._git_commit.hexsha if source_plugin._git_commit is not None else None,
+                    'file_path': source_plugin.file_path,
+                } for source_plugin in self._source_plugins
+            ],
+            'phases': self._phase_timings,
+            'files': self._file_timings,
+        }
+        with open(self.profile_path, 'a') as pfh:
+            pfh.write(json.dumps(profile, sort_keys=True) + '\n')
 
     def clean_cache(self):
-        # remove repository directory if delete flag is set
-        if self.delete_repo_cache and os.path.isdir(self._git_repo_path):
-            self.log("Cleaning repository cache at {self._git_repo_path}")
-            rmtree(self._git_repo_path)
+        # remove repository cache directory if delete flag is set
+        # every load reading the cache holds a shared lock on it, so it is only removed when no other load is reading it,
+        # and renamed away first so no other process sees a partially removed cache
+        if self.delete_repo_cache and os.path.isdir(self._git_cache_path):
+            with self._cache_lock(self._git_cache_read_lock_path, blocking=False) as locked:
+                if not locked:
+                    self.log("Not cleaning repository cache at %s, another inventory load is reading it", self._git_cache_path)
+                elif os.path.isdir(self._git_cache_path):
+                    self.log("Cleaning repository cache at %s", self._git_cache_path)
+                    self._remove_cache_path(self._git_cache_path)
 
-    def _update_repository(self):
-        self.log("enter _update_repository")
-        if self.ssh_key:
-            os.environ['GIT_SSH_COMMAND'] = 'ssh -i ' + self.ssh_key
+    def _lock_cache_for_reading(self, lock_path):
+        # held until the inventory load finishes, the fetch lock cannot be used as a load that holds it shared could never fetch
+        cache_read_lock_fh = open(lock_path, 'a')
+        fcntl.flock(cache_read_lock_fh, fcntl.LOCK_SH)
+        self._cache_read_locks.append(cache_read_lock_fh)
+        return cache_read_lock_fh
 
-        git_url_info = giturlparse.parse(self.git_url)
-        git_repo_name = git_url_info.name
+    def _release_cache_read_locks(self):
+        while self._cache_read_locks:
+            self._cache_read_locks.pop().close()
+
+    @contextmanager
+    def _cache_lock(self, lock_path, blocking=True):
+        # yields False instead of waiting when blocking is False and another process holds the lock
+        with open(lock_path, 'a') as lock_fh:
+            try:
+                fcntl.flock(lock_fh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
 
-        self.log(f"setting _git_repo_path git_repo_cache_dir={self.git_repo_cache_dir} git_repo_name={git_repo_name}")
-        self._git_repo_path = os.path.join(self.git_repo_cache_dir, git_repo_name)
-        self.log(f"_git_repo_path = {self._git_repo_path}")
-        git_repo_git_dir_path = os.path.join(self._git_repo_path, '.git')
+    def _remove_cache_path(self, cache_path):
+        removed_cache_path = f"{cache_path}.removed-{os.getpid()}-{time.time()}"
+        os.rename(cache_path, removed_cache_path)
+        rmtree(removed_cache_path)
+
+    def _update_repository(self):
+        self.log("enter _update_repository")
+        self._set_repository_cache_paths()
 
         if self.delete_repo_cache:
-            self.log(f"Ensuring repository cache clean before clone {self._git_repo_path}")
+            self.log("Ensuring repository cache clean before clone %s", self._git_cache_path)
             self.clean_cache()
+        self._lock_cache_for_reading(self._git_cache_read_lock_path)
 
-        if not os.path.exists(self._git_repo_path):
-            self.log(f"Cloning repository {self._git_repo_path}. Cache clone directory {self._git_repo_path} does not exist.")
-            repo = git.Repo.clone_from(self.git_url, self._git_repo_path)
+        if not os.path.isdir(self._git_mirror_path):
+            with self._cache_lock(self._git_cache_lock_path):
+                if not os.path.isdir(self._git_mirror_path):
+                    self._init_mirror()
+
+        self.log("Using repository mirror found at %s", self._git_mirror_path)
+        repo = self._open_repository(self._git_mirror_path)
+        self._git_commit = self._find_commit(repo)
+        if self._git_commit is None:
+            self.log("Commit %s not found in repository cache", self.commit)
+            self._fetch_mirror(repo)
+        elif self._get_fetch_age() >= self.git_repo_cache_update_time_seconds:
+            if self.git_repo_cache_stale_while_revalidate:
+                self._fetch_mirror_in_background()
+            else:
+                self._fetch_mirror(repo)
         else:
-            self.log(f"Using repository found at {self._git_repo_path}")
-            repo = git.Repo(self._git_repo_path)
-            # check for recently updated to prevent unnecessary checkouts
-            repo_git_dir_mtime = os.path.getmtime(git_repo_git_dir_path)
-            repo_git_dir_mtime_age = time.time() - repo_git_dir_mtime
-            if repo_git_dir_mtime_age < self.git_repo_cache_update_time_seconds:
-                self.log(
-                    f"Skipping repository update: last modified {repo_git_dir_mtime_age} seconds ago while threshold is {self.git_repo_cache_update_time_seconds}")
+            self.log("Skipping repository update: last fetched %s seconds ago while threshold is %s",
+                     self._get_fetch_age(), self.git_repo_cache_update_time_seconds)
+
+        if self.git_read_mode == 'objects':
+            self._git_repo_path = self._git_mirror_path
+            self.log("Reading repository objects at commit %s %s", self.commit, self._git_commit.hexsha)
+            return
+
+        self._git_repo_path = self._get_snapshot(repo)
+        self.log("Using repository commit %s snapshot at %s", self.commit, self._git_repo_path)
+
+    def _set_repository_cache_paths(self):
+        # key the cache on the full URL, repositories with the same name from different owners must not collide
+        git_url_info = giturlparse.parse(self.git_url)
+        git_repo_name = git_url_info.name or 'repository'
+        git_url_hash = hashlib.sha1(to_bytes(self.git_url)).hexdigest()[:12]
+
+        self.log("setting _git_cache_path git_repo_cache_dir=%s git_repo_name=%s", self.git_repo_cache_dir, git_repo_name)
+        self._git_cache_path = os.path.join(self.git_repo_cache_dir, f"{git_repo_name}-{git_url_hash}")
+        # lock files live beside the cache directory so they survive the directory being cleaned
+        self._git_cache_lock_path = f"{self._git_cache_path}.lock"
+        self._git_cache_read_lock_path = f"{self._git_cache_path}.read.lock"
+        self._git_mirror_path = os.path.join(self._git_cache_path, 'mirror.git')
+        # each fetch only updates the ref named by commit, so each ref has its own fetch time
+        commit_hash = hashlib.sha1(to_bytes(self.commit)).hexdigest()[:12]
+        self._git_fetch_time_path = os.path.join(self._git_cache_path, f"fetch_time-{commit_hash}")
+        self._git_refresh_log_path = os.path.join(self._git_cache_path, f"refresh-{commit_hash}.log")
+        self.log("_git_cache_path = %s", self._git_cache_path)
+        os.makedirs(self.git_repo_cache_dir, exist_ok=True)
+
+    def refresh_repository(self, git_url, commit, git_repo_cache_dir, ssh_key=None, git_clone_depth=None, git_clone_filter=None,
+                           update_time_seconds=0):
+        ''' Fetch commit of git_url into its existing repository cache when the commit was fetched longer than
+            update_time_seconds ago, returning at once when another process is fetching
+        '''
+        self.git_url = git_url
+        self.commit = commit
+        self.git_repo_cache_dir = git_repo_cache_dir
+        self.ssh_key = ssh_key
+        self.git_clone_depth = git_clone_depth
+        self.git_clone_filter = git_clone_filter
+        self.git_repo_cache_update_time_seconds = update_time_seconds
+        self._set_repository_cache_paths()
+        self._lock_cache_for_reading(self._git_cache_read_lock_path)
+        try:
+            if not os.path.isdir(self._git_mirror_path):
+                self.log("Repository cache %s was removed, nothing to refresh", self._git_cache_path)
+                return
+            repo = self._open_repository(self._git_mirror_path)
+            self._git_commit = self._find_commit(repo)
+            if self._git_commit is not None:
+                self._fetch_mirror(repo)
+        finally:
+            self._release_cache_read_locks()
+
+    def _open_repository(self, repository_path):
+        repo = git.Repo(repository_path)
+        if self.ssh_key:
+            # only this repository's git commands use the key, sources updated concurrently can use different keys
+            repo.git.update_environment(GIT_SSH_COMMAND='ssh -i ' + self.ssh_key)
+        return repo
+
+    def _init_mirror(self):
+        # bare mirror is initialized aside and renamed into place so it is never seen half created
+        self.log("Initializing repository mirror %s", self._git_mirror_path)
+        os.makedirs(self._git_cache_path, exist_ok=True)
+        mirror_init_path = f"{self._git_mirror_path}.init-{os.getpid()}"
+        with self._timed('init'):
+            repo = git.Repo.init(mirror_init_path, bare=True)
+            repo.create_remote('origin', self.git_url)
+            os.rename(mirror_init_path, self._git_mirror_path)
+
+    def _get_fetch_age(self):
+        try:
+            return time.time() - os.path.getmtime(self._git_fetch_time_path)
+        except OSError:
+            return float('inf')
+
+    def _fetch_mirror(self, repo):
+        # a process that already has the commit never waits on a fetch in progress, it uses the cached commit
+        with self._cache_lock(self._git_cache_lock_path, blocking=self._git_commit is None) as locked:
+            if not locked:
+                self.log("Repository fetch in progress by another process, using cached commit")
+                return
+
+            # another process may have fetched while this one waited on the lock
+            self._git_commit = self._find_commit(repo)
+            if self._git_commit is not None and self._get_fetch_age() < self.git_repo_cache_update_time_seconds:
+                self.log("Skipping repository update: fetched by another process")
                 return
 
-            # Checking out the master branch ensures that we will not be in a detached head state when we pull to update
-            self.log('Checking out repository master')
-            repo.git.checkout("master")
+            # ls-remote of the single ref is much cheaper than a fetch when the remote has not moved
+            remote_refs = self._list_remote_refs(repo)
+            remote_commit_sha = self._find_remote_commit_sha(remote_refs)
+            if self._git_commit is not None and remote_commit_sha in (None, self._git_commit.hexsha):
+                self.log("Skipping repository fetch: remote commit %s is unchanged", self.commit)
+            else:
+                self._fetch_commit(repo, remote_refs)
+
+            self.log('Updating fetch time to now')
+            with open(self._git_fetch_time_path, 'a'):
+                os.utime(self._git_fetch_time_path, None)
+
+        self._git_commit = self._resolve_commit(repo)
+
+    def _fetch_mirror_in_background(self):
+        # the refresh runs in a new interpreter in its own session so it outlives this process,
+        # forking this one could leave the child holding a lock another thread held at that moment
+        self.log("Refreshing repository cache in background, using cached commit")
+        self._report_background_refresh()
+        # run as the python -m entry point, running this file as a script would import it in place of GitPython
+        collections_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', '..'))
+        python_paths = [collections_path]
+        if os.environ.get('PYTHONPATH'):
+            python_paths.append(os.environ['PYTHONPATH'])
+        refresh_env = dict(os.environ, PYTHONPATH=os.pathsep.join(python_paths))
+        refresh_args = [sys.executable, '-m', CLI_MODULE_NAME, 'refresh', self.git_url, '--commit', self.commit,
+                        '--git-repo-cache-dir', self.git_repo_cache_dir,
+                        '--update-time-seconds', str(self.git_repo_cache_update_time_seconds)]
+        if self.ssh_key:
+            refresh_args += ['--ssh-key', self.ssh_key]
+        if self.git_clone_depth:
+            refresh_args += ['--git-clone-depth', str(self.git_clone_depth)]
+        if self.git_clone_filter:
+            refresh_args += ['--git-clone-filter', self.git_clone_filter]
+        # the refresh only writes output when it fails, so its log is empty after a successful refresh
+        with open(self._git_refresh_log_path, 'wb') as refresh_log_fh:
+            subprocess.Popen(refresh_args, env=refresh_env, cwd='/', stdin=subprocess.DEVNULL, stdout=refresh_log_fh, stderr=subprocess.STDOUT,
+                             close_fds=True, start_new_session=True)
+
+    def _report_background_refresh(self):
+        # a refresh failing every time never advances the fetch time, so every load would keep using the stale commit unnoticed
+        try:
+            with open(self._git_refresh_log_path, 'r') as refresh_log_fh:
+                refresh_log = refresh_log_fh.read().strip()
+        except IOError:
+            refresh_log = ''
+        if refresh_log:
+            self.log("Last background refresh of repository cache %s failed:\n%s", self._git_cache_path, refresh_log)
+        fetch_age = self._get_fetch_age()
+        stale_warning_seconds = self.git_repo_cache_update_time_seconds * self.ANSIBLE_INVENTORY_GIT_STALE_WARNING_UPDATE_TIMES
+        if self.git_repo_cache_update_time_seconds and fetch_age >= stale_warning_seconds:
+            self.display.warning(f"Repository cache of {self.git_url} commit {self.commit} was last fetched {fetch_age:.0f} seconds ago, "
+                                 f"background refreshes may be failing, see {self._git_refresh_log_path}")
+
+    def _get_snapshot(self, repo):
+        # snapshots are immutable once renamed into place,
+        # readers only hold their lock shared so a snapshot is not pruned while an inventory load uses it
+        snapshot_name = self._git_commit.hexsha
+        if self.git_sparse_checkout:
+            # the files reached from file_path only depend on the commit, so they are only found when the snapshot is created
+            snapshot_name += '-' + hashlib.sha1(to_bytes(posixpath.normpath(self.file_path))).hexdigest()[:12]
+        snapshots_path = os.path.join(self._git_cache_path, 'snapshots')
+        snapshot_path = os.path.join(snapshots_path, snapshot_name)
 
-            self.log('Pulling repository remote origin')
-            repo.remotes.origin.pull()
+        os.makedirs(snapshots_path, exist_ok=True)
+        snapshot_lock_fh = self._lock_cache_for_reading(f"{snapshot_path}.lock")
+        if not os.path.isdir(snapshot_path):
+            # flock gives up the shared lock before taking it exclusive, so loads creating the same snapshot do not deadlock
+            fcntl.flock(snapshot_lock_fh, fcntl.LOCK_EX)
+            try:
+                if not os.path.isdir(snapshot_path):
+                    snapshot_file_paths = self._find_sparse_checkout_paths() if self.git_sparse_checkout else None
+                    self._create_snapshot(repo, snapshot_path, snapshot_file_paths)
+            finally:
+                fcntl.flock(snapshot_lock_fh, fcntl.LOCK_SH)
+            self._prune_snapshots(snapshots_path)
+
+        # mark the snapshot used so it is not pruned
+        os.utime(snapshot_path, None)
+        return snapshot_path
+
+    def _create_snapshot(self, repo, snapshot_path, snapshot_file_paths=None):
+        self.log("Checking out repository commit %s %s to snapshot %s", self.commit, self._git_commit.hexsha, snapshot_path)
+        snapshot_create_path = f"{snapshot_path}.create-{os.getpid()}"
+        with self._timed('checkout'), tempfile.TemporaryFile() as archive_fh:
+            repo.archive(archive_fh, treeish=self._git_commit.hexsha, format='tar', path=snapshot_file_paths or [])
+            archive_fh.seek(0)
+            with tarfile.open(fileobj=archive_fh) as archive:
+                archive.extractall(snapshot_create_path)
+            os.rename(snapshot_create_path, snapshot_path)
+
+    def _prune_snapshots(self, snapshots_path):
+        for snapshot_name in os.listdir(snapshots_path):
+            snapshot_path = os.path.join(snapshots_path, snapshot_name)
+            if not os.path.isdir(snapshot_path) or '.' in snapshot_name:
+                continue
+            if time.time() - os.path.getmtime(snapshot_path) < self.git_repo_cache_snapshot_max_age_seconds:
+                continue
+            # a snapshot an inventory load is using is locked shared by it
+            with self._cache_lock(f"{snapshot_path}.lock", blocking=False) as locked:
+                if locked and os.path.isdir(snapshot_path) and time.time() - os.path.getmtime(snapshot_path) >= self.git_repo_cache_snapshot_max_age_seconds:
+                    self.log("Removing unused repository snapshot %s", snapshot_path)
+                    self._remove_cache_path(snapshot_path)
 
-            self.log('Updating .git dir modified time to now')
-            now_time = time.time()
-            os.utime(git_repo_git_dir_path, (now_time, now_time))
+    def _list_remote_refs(self, repo):
+        remote_refs = {}
+        with self._timed('ls_remote'):
+            remote_ref_lines = repo.git.ls_remote('origin', self.commit).splitlines()
+        for remote_ref_line in remote_ref_lines:
+            remote_ref_sha, remote_ref_name = remote_ref_line.split('\t', 1)
+            remote_refs[remote_ref_name] = remote_ref_sha
+        return remote_refs
 
-        self.log(f"Checking out repository commit {self.commit}")
-        repo.git.checkout(self.commit)
+    def _find_remote_commit_sha(self, remote_refs):
+        # an annotated tag is listed peeled with ^{} as the commit it points to
+        for remote_ref_name in (f"refs/heads/{self.commit}", f"refs/tags/{self.commit}^{{}}", f"refs/tags/{self.commit}"):
+            if remote_ref_name in remote_refs:
+                return remote_refs[remote_ref_name]
+        return None
+
+    def _fetch_commit(self, repo, remote_refs):
+        # fetch only the ref named by commit, rather than pulling every branch
+        fetch_options = {}
+        if self.git_clone_depth:
+            fetch_options['depth'] = self.git_clone_depth
+        if self.git_clone_filter:
+            fetch_options['filter'] = self.git_clone_filter
+
+        if f"refs/heads/{self.commit}" in remote_refs:
+            refspec = f"+refs/heads/{self.commit}:refs/remotes/origin/{self.commit}"
+        elif f"refs/tags/{self.commit}" in remote_refs:
+            refspec = f"+refs/tags/{self.commit}:refs/tags/{self.commit}"
+        else:
+            # not a branch or tag, so commit must be a commit SHA
+            refspec = self.commit
+
+        # the first fetch into an empty mirror transfers the whole history, the same as a clone
+        fetch_phase = 'clone' if self._is_empty_mirror(repo) else 'fetch'
+        self.log("Fetching repository remote origin %s", refspec)
+        with self._timed(fetch_phase):
+            repo.git.fetch('origin', refspec, **fetch_options)
+
+    def _is_empty_mirror(self, repo):
+        # a mirror holds objects either packed or loose in two hex digit directories
+        objects_path = os.path.join(repo.git_dir, 'objects')
+        for objects_dir_name in os.listdir(objects_path):
+            if objects_dir_name == 'pack':
+                if any(pack_name.endswith('.pack') for pack_name in os.listdir(os.path.join(objects_path, 'pack'))):
+                    return False
+            elif len(objects_dir_name) == 2:
+                return False
+        return True
+
+    def _resolve_commit(self, repo):
+        commit = self._find_commit(repo)
+        if commit is None:
+            raise AnsibleError(f"Unable to resolve commit '{self.commit}' in repository {self.git_url}")
+        return commit
+
+    def _find_commit(self, repo):
+        # prefer the remote tracking branch, a local branch is not moved by fetch
+        for rev in (f"origin/{self.commit}", self.commit):
+            try:
+                return repo.commit(rev)
+            except (git.BadName, git.BadObject, ValueError):
+                continue
+        return None
+
+    def _find_sparse_checkout_paths(self):
+        # directories of every file reachable from file_path, read from the object database before checkout
+        # files at the repository root are listed themselves so the whole repository is not included
+        file_paths = set()
+        self._find_include_closure(posixpath.normpath(self.file_path), file_paths)
+        return sorted(set(posixpath.dirname(file_path) or file_path for file_path in file_paths))
+
+    def _find_include_closure(self, inventory_file_path, file_paths):
+        if inventory_file_path in file_paths:
+            return
+        file_paths.add(inventory_file_path)
+        inventory_tree = self._load_cached_file(inventory_file_path, 'inventory', self._load_inventory_data, from_objects=True)
+        include_file_paths, include_var_file_paths = self._find_tree_includes(inventory_file_path, inventory_tree)
+        for include_file_path in include_file_paths:
+            self._find_include_closure(posixpath.normpath(include_file_path), file_paths)
+        file_paths.update(posixpath.normpath(include_var_file_path) for include_var_file_path in include_var_file_paths)
+
+    def _find_tree_includes(self, inventory_file_path, parent, include_file_paths=None, include_var_file_paths=None):
+        # walk an inventory tree the same way _build_inventory does, collecting includes and include_vars paths as it joins them
+        if include_file_paths is None:
+            include_file_paths, include_var_file_paths = [], []
+        for child_name, child in parent.items():
+            if child is None or child_name == 'vars':
+                continue
+            elif self.ANSIBLE_INVENTORY_GIT_HOST_TYPE in child and child[self.ANSIBLE_INVENTORY_GIT_HOST_TYPE] == 'host':
+                continue
+            elif child_name == 'includes':
+                for include_file in child:
+                    include_file_paths.append(os.path.join(os.path.dirname(inventory_file_path), include_file))
+            elif child_name == 'include_vars':
+                for include_var_file in child:
+                    include_var_file_paths.append(os.path.join(os.path.dirname(inventory_file_path), include_var_file))
+            else:
+                self._find_tree_includes(inventory_file_path, child, include_file_paths, include_var_file_paths)
+        return include_file_paths, include_var_file_paths
+
+    def _prefetch_include_graph(self, inventory_file_path):
+        # read and parse every file reachable from inventory_file_path concurrently,
+        # the inventory is then built from the memoized trees exactly as it would be without prefetching
+        if not self.prefetch_workers:
+            return
+        self.log("Prefetching include graph of %s with %s workers", inventory_file_path, self.prefetch_workers)
+        include_graph = {}
+        with self._timed('prefetch'), self._vault_decrypt_workers(), ThreadPoolExecutor(max_workers=self.prefetch_workers) as executor:
+            pending = {executor.submit(self._read_inventory_file, inventory_file_path): ('inventory', inventory_file_path)}
+            # files are followed once by normalized path, so an include cycle ends the walk rather than growing paths forever
+            prefetched = set([('inventory', os.path.normpath(inventory_file_path))])
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_kind, file_path = pending.pop(future)
+                    file_tree = future.result()
+                    if file_kind != 'inventory':
+                        continue
+                    include_file_paths, include_var_file_paths = self._find_tree_includes(file_path, file_tree)
+                    include_graph[os.path.normpath(file_path)] = [os.path.normpath(path) for path in include_file_paths]
+                    for prefetch in [('inventory', path) for path in include_file_paths] + [('variables', path) for path in include_var_file_paths]:
+                        if (prefetch[0], os.path.normpath(prefetch[1])) in prefetched:
+                            continue
+                        prefetched.add((prefetch[0], os.path.normpath(prefetch[1])))
+                        read_file = self._read_inventory_file if prefetch[0] == 'inventory' else self._read_variable_file
+                        pending[executor.submit(read_file, prefetch[1])] = prefetch
+        self._check_include_cycles(include_graph, [os.path.normpath(inventory_file_path)])
+
+    @contextmanager
+    def _vault_decrypt_workers(self):
+        # decryption is CPU bound, worker processes let vault files prefetched by different threads use different cores
+        if not self.vault_decrypt_workers:
+            yield
+            return
+        with ProcessPoolExecutor(max_workers=self.vault_decrypt_workers) as vault_decrypt_executor:
+            # workers are forked now, before the prefetch threads start and could hold a lock the children inherit
+            vault_decrypt_executor.submit(int).result()
+            # secrets such as a vault password file are read once here, workers get their bytes in memory
+            self._vault_decrypt_secrets = [(vault_id, VaultSecret(vault_secret.bytes)) for vault_id, vault_secret in self.loader._vault.secrets]
+            self._vault_decrypt_executor = vault_decrypt_executor
+            try:
+                yield
+            finally:
+                self._vault_decrypt_executor = None
+                self._vault_decrypt_secrets = None
+
+    def _check_include_cycles(self, include_graph, include_stack, checked=None):
+        if checked is None:
+            checked = set()
+        for include_file_path in include_graph.get(include_stack[-1], []):
+            if include_file_path in include_stack:
+                self._raise_include_cycle(include_stack, include_file_path)
+            if include_file_path not in checked:
+                self._check_include_cycles(include_graph, include_stack + [include_file_path], checked)
+        checked.add(include_stack[-1])
+
+    def _push_include(self, include_file_path):
+        # including a file that is already being built would recurse forever
+        include_file_path = os.path.normpath(include_file_path)
+        if include_file_path in self._include_stack:
+            self._raise_include_cycle(self._include_stack, include_file_path)
+        self._include_stack.append(include_file_path)
+
+    def _raise_include_cycle(self, include_stack, include_file_path):
+        include_cycle = include_stack[include_stack.index(include_file_path):] + [include_file_path]
+        raise AnsibleParserError(f"Inventory include cycle detected: {' -> '.join(include_cycle)}")
+
+    def _repository_file_exists(self, file_path):
+        try:
+            self._git_commit.tree / file_path
+        except KeyError:
+            return False
+        return True
+
+    def _get_repository_blob(self, file_path):
+        try:
+            with self._git_lock:
+                return self._git_commit.tree / posixpath.normpath(file_path)
+        except KeyError:
+            raise AnsibleError(f"File '{file_path}' not found in repository {self.git_url} at commit {self._git_commit.hexsha}")
+
+    def _read_repository_file(self, file_path):
+        # blob data is read through the repository's persistent git cat-file --batch process
+        blob = self._get_repository_blob(file_path)
+        with self._git_lock:
+            return blob.data_stream.read()
 
     def _read_inventory_file(self, inventory_file_path):
-        self.log(f"Reading inventory file {inventory_file_path}")
-        with open(inventory_file_path, 'r') as ifh:
-            inventory_tree = yaml.load(ifh, Loader=yaml.SafeLoader)
-            return inventory_tree
+        self.log("Reading inventory file %s", inventory_file_path)
+        return self._load_cached_file(inventory_file_path, 'inventory', self._load_inventory_data)
 
     def _read_variable_file(self, variable_file_path):
-        self.log(f"Reading variable file {variable_file_path}")
-        variable_tree = self.loader.load_from_file(variable_file_path)
-        return variable_tree
+        self.log("Reading variable file %s", variable_file_path)
+        if not self._git_object_reads:
+            variable_file_path = self.loader.path_dwim(variable_file_path)
+        return self._load_cached_file(variable_file_path, 'variables', self._load_variable_data)
+
+    def _load_inventory_data(self, inventory_file_path, b_inventory_data):
+        inventory_tree = yaml.load(b_inventory_data, Loader=YAML_SAFE_LOADER)
+        return inventory_tree, True
+
+    def _load_variable_data(self, variable_file_path, b_variable_data):
+        variable_file_name = variable_file_path
+        if self._git_object_reads:
+            variable_file_name = f"{self.git_url}@{self._git_commit.hexsha}:{variable_file_path}"
+        b_variable_data, show_content = self._decrypt_vault_data(b_variable_data, to_bytes(variable_file_name))
+        variable_tree = self.loader.load(to_text(b_variable_data), file_name=variable_file_name, show_content=show_content)
+        # decrypted file content must never be persisted
+        return variable_tree, show_content
+
+    def _decrypt_vault_data(self, b_vault_data, b_file_name):
+        # decrypt whole file vault content the same way loader.load_from_file does
+        if not is_encrypted(b_vault_data):
+            return b_vault_data, True
+        if self._compiling:
+            # a compiled inventory only keeps vault values as ciphertext, it must not contain the content of a decrypted file
+            raise AnsibleError(f"{to_native(b_file_name)} is vault encrypted as a whole and cannot be compiled, encrypt its values with !vault instead")
+        with self._timed('decrypt'):
+            if self._vault_decrypt_executor is not None:
+                b_plaintext = self._vault_decrypt_executor.submit(_decrypt_in_vault_worker, self._vault_decrypt_secrets, b_vault_data, b_file_name).result()
+            else:
+                b_plaintext = self.loader._vault.decrypt(b_vault_data, filename=b_file_name)
+        return b_plaintext, False
+
+    def _load_cached_file(self, file_path, file_kind, load_data, from_objects=None):
+        # parsed files are memoized by content and shared by every file that references them, never copied,
+        # callers keep the values but copy any mapping they change, as host vars are copied into the host entry
+        if from_objects is None:
+            from_objects = self._git_object_reads
+        b_file_data = None
+        file_hash = self._file_hashes.get((from_objects, file_path))
+        if file_hash is None:
+            if from_objects:
+                # the blob SHA is known from the tree without reading the blob
+                file_hash = self._get_repository_blob(file_path).hexsha
+            else:
+                with open(file_path, 'rb') as fh:
+                    b_file_data = fh.read()
+                file_hash = hashlib.sha1(b'blob %d\x00' % len(b_file_data) + b_file_data).hexdigest()
+
+        parse_cache_key = f"{file_kind}-{file_hash}"
+        if parse_cache_key not in self._parse_cache:
+            found, file_tree = self._read_parse_cache_file(parse_cache_key)
+            if not found:
+                if b_file_data is None:
+                    b_file_data = self._read_repository_file(file_path)
+                parse_start = time.perf_counter()
+                file_tree, persistable = load_data(file_path, b_file_data)
+                parse_seconds = time.perf_counter() - parse_start
+                self._add_phase_timing('parse', parse_seconds)
+                self._file_timings.append({'file': file_path, 'kind': file_kind, 'seconds': parse_seconds})
+                if persistable:
+                    self._write_parse_cache_file(parse_cache_key, file_tree)
+                else:
+                    self._decrypted_parse_cache_keys.add(parse_cache_key)
+            self._parse_cache[parse_cache_key] = self._read_only_view(file_tree)
+        else:
+            self.log("Using parsed %s file %s %s", file_kind, file_path, file_hash)
+        if parse_cache_key in self._decrypted_parse_cache_keys:
+            self._read_decrypted_file = True
+        self._file_hashes[(from_objects, file_path)] = file_hash
+        return self._parse_cache[parse_cache_key]
+
+    def _read_only_view(self, file_tree):
+        # a mapping proxy fails any attempt to change a shared tree in place,
+        # nested values stay plain dictionaries and lists so they are set as inventory variables as they are
+        if isinstance(file_tree, dict):
+            return MappingProxyType(file_tree)
+        return file_tree
+
+    def _get_parse_cache_file_path(self, parse_cache_key):
+        return os.path.join(self.git_repo_cache_dir, 'parse_cache', f"{parse_cache_key}.json")
+
+    def _read_parse_cache_file(self, parse_cache_key):
+        if not self.persist_parse_cache:
+            return False, None
+        try:
+            with open(self._get_parse_cache_file_path(parse_cache_key), 'r') as pfh:
+                return True, self._from_cacheable(json.load(pfh))
+        except (IOError, ValueError):
+            return False, None
+
+    def _write_parse_cache_file(self, parse_cache_key, file_tree):
+        # only trees that round trip through JSON unchanged are persisted, YAML dates or integer keys are not
+        if not self.persist_parse_cache or not self._is_json_safe(file_tree):
+            return
+        parse_cache_file_path = self._get_parse_cache_file_path(parse_cache_key)
+        os.makedirs(os.path.dirname(parse_cache_file_path), exist_ok=True)
+        # written aside and renamed into place so concurrent runs never read a partial file
+        parse_cache_write_path = f"{parse_cache_file_path}.write-{os.getpid()}-{threading.get_ident()}"
+        with open(parse_cache_write_path, 'w') as pfh:
+            json.dump(self._to_cacheable(file_tree), pfh)
+        os.replace(parse_cache_write_path, parse_cache_file_path)
+
+    def _is_json_safe(self, data):
+        if isinstance(data, (AnsibleVaultEncryptedUnicode, string_types, bool, int, float, NoneType)):
+            return True
+        if isinstance(data, MutableMapping):
+            return all(isinstance(key, string_types) and self._is_json_safe(value) for key, value in data.items())
+        if isinstance(data, list):
+            return all(self._is_json_safe(value) for value in data)
+        return False
+
+    def _build_file(self, inventory_file_path, inventory, inventory_name):
+        # an inventory file unchanged since the recorded build, along with every file it includes, is replayed from the record
+        repository_file_path = self._to_repository_path(inventory_file_path) if self._recording_build else None
+        if self._build_ops is not None:
+            self._build_ops.append(['include', inventory_file_path])
+        if self._is_build_reusable(repository_file_path):
+            self.log("Reusing recorded build of %s", repository_file_path)
+            self._replay_build(inventory, repository_file_path)
+            return inventory
+
+        inventory_tree = self._read_inventory_file(inventory_file_path)
+        if not self._recording_build:
+            return self._build_inventory(inventory_file_path=inventory_file_path, inventory=inventory,
+                                         parent=inventory_tree, parent_name=inventory_name)
+        parent_build_ops = self._build_ops
+        self._build_ops = []
+        try:
+            inventory = self._build_inventory(inventory_file_path=inventory_file_path, inventory=inventory,
+                                              parent=inventory_tree, parent_name=inventory_name)
+            self._record_build(repository_file_path, self._build_ops)
+        finally:
+            self._build_ops = parent_build_ops
+        return inventory
 
     def _build_inventory(self, inventory_file_path, inventory, parent, parent_name):
-        self.log(f"Build inventory from inventory_file_path {inventory_file_path}\n parent {parent_name} = {json.dumps(parent)}")
+        if self._log_enabled():
+            self.log("Build inventory from inventory_file_path %s\n parent %s = %s", inventory_file_path, parent_name, json.dumps(dict(parent)))
 
         # build host group
-        inventory[parent_name] = {
-            'children': []
-        }
+        self._build_op(inventory, 'group', parent_name)
         for child_name, child in parent.items():
             if child is None:
                 # when child is None,
                 # make it a host group in this group only
-                if 'children' not in inventory[parent_name]:
-                    inventory[parent_name]['children'] = []
-                inventory[parent_name]['children'].append(child_name)
+                self._build_op(inventory, 'child', parent_name, child_name)
                 # only type: host declarations are ansible inventory hosts - see next case
             # if type is host, put host and its variables in hosts entry for the parent
             elif self.ANSIBLE_INVENTORY_GIT_HOST_TYPE in child and child[self.ANSIBLE_INVENTORY_GIT_HOST_TYPE] == 'host':
                 self.log("adding child host type to parent")
-                # put host in list of hosts in the group
-                if 'hosts' not in inventory[parent_name]:
-                    inventory[parent_name]['hosts'] = dict()
-                inventory[parent_name]['hosts'][child_name] = None
-                # update host entry with vars if any are defined
                 # hosts are different where vars are defined in a dict that is specified as the value of the host node
                 # https://docs.ansible.com/ansible/latest/dev_guide/developing_inventory.html#tuning-the-external-inventory-script
+                host_vars = None
                 if 'vars' in child:
-                    if inventory[parent_name]['hosts'][child_name] == None:
-                        inventory[parent_name]['hosts'][child_name] = {}
-                    inventory[parent_name]['hosts'][child_name].update(child['vars'])
+                    host_vars = {}
+                    host_vars.update(child['vars'])
+                self._build_op(inventory, 'host', parent_name, child_name, host_vars)
             elif child_name == 'vars':
-                self.log(f"{parent_name} vars child found")
+                self.log("%s vars child found", parent_name)
                 # child is variables for this host group
-                host_group_vars = {}
-                if 'vars' in inventory[parent_name]:
-                    self.log(f"existing vars found in {parent_name}")
-                    host_group_vars = copy.deepcopy(inventory[parent_name]['vars'])
-                host_group_vars.update(child)
-                inventory[parent_name]['vars'] = host_group_vars
+                self._build_op(inventory, 'vars', parent_name, child)
             elif child_name == 'includes':
                 # child is include file list to add to this host group
                 for include_file in child:
                     include_file_path = os.path.join(os.path.dirname(inventory_file_path), include_file)
-                    self.log(f"{parent_name} parents include file {include_file_path}")
-                    include_inventory_tree = self._read_inventory_file(include_file_path)
+                    self.log("%s parents include file %s", parent_name, include_file_path)
+                    self._push_include(include_file_path)
                     include_inventory_name = os.path.basename(include_file_path).split('.')[0]
-                    if 'children' not in inventory[parent_name]:
-                        inventory[parent_name]['children'] = []
-                    inventory[parent_name]['children'].append(include_inventory_name)
-                    inventory = self._build_inventory(inventory_file_path=include_file_path, inventory=inventory,
-                                                      parent=include_inventory_tree, parent_name=include_inventory_name)
+                    self._build_op(inventory, 'child', parent_name, include_inventory_name)
+                    inventory = self._build_file(include_file_path, inventory, include_inventory_name)
+                    self._include_stack.pop()
             elif child_name == 'include_vars':
                 # child is include variable file list to add to this host group
                 for include_var_file in child:
                     include_var_file_path = os.path.join(os.path.dirname(inventory_file_path), include_var_file)
-                    self.log(f"{parent_name} includes var file {include_var_file_path}")
-                    include_variable_tree = self._read_variable_file(include_var_file_path)
+                    self.log("%s includes var file %s", parent_name, include_var_file_path)
                     # add variables to parent host group variables
-                    host_group_vars = {}
-                    if 'vars' in inventory[parent_name]:
-                        self.log(f"existing vars found in {parent_name}")
-                        host_group_vars = copy.deepcopy(inventory[parent_name]['vars'])
-                    host_group_vars.update(include_variable_tree)
-                    inventory[parent_name]['vars'] = host_group_vars
+                    self._build_op(inventory, 'include_vars', parent_name, include_var_file_path)
             else:
                 # else, add child to current group
-                if 'children' not in inventory[parent_name]:
-                    inventory[parent_name]['children'] = []
-                inventory[parent_name]['children'].append(child_name)
+                self._build_op(inventory, 'child', parent_name, child_name)
                 # process child host group
-                self.log(f"recursing into child host group {child_name}")
+                self.log("recursing into child host group %s", child_name)
                 inventory = self._build_inventory(inventory_file_path=inventory_file_path,
                                                   inventory=inventory, parent=child, parent_name=child_name)
 
         return inventory
 
+    def _build_op(self, inventory, *build_op):
+        # every change _build_inventory makes goes through here, so it can be recorded and replayed in the same order
+        build_op = list(build_op)
+        if self._build_ops is not None:
+            self._build_ops.append(build_op)
+        # populate_mode direct builds into the Ansible inventory itself
+        if inventory is self.inventory:
+            self._apply_direct_op(build_op)
+        else:
+            self._apply_build_op(inventory, build_op)
+
+    def _apply_build_op(self, inventory, build_op):
+        op_name, group_name = build_op[0], build_op[1]
+        if op_name == 'group':
+            # a group defined again replaces its earlier definition
+            inventory[group_name] = {
+                'children': []
+            }
+        elif op_name == 'child':
+            inventory[group_name].setdefault('children', []).append(build_op[2])
+        elif op_name == 'host':
+            host_vars = build_op[3]
+            inventory[group_name].setdefault('hosts', dict())[build_op[2]] = dict(host_vars) if host_vars is not None else None
+        elif op_name == 'vars':
+            self._add_group_vars_layer(inventory[group_name], build_op[2])
+        elif op_name == 'include_vars':
+            self._add_group_vars_layer(inventory[group_name], self._read_variable_file(build_op[2]))
+
+    def _record_build(self, repository_file_path, build_ops):
+        # recorded paths are relative to the repository root, as checkout snapshot paths change with the commit
+        recorded_build_ops = []
+        for build_op in build_ops:
+            if build_op[0] == 'include':
+                build_op = ['include', self._to_repository_path(build_op[1])]
+            elif build_op[0] == 'include_vars':
+                build_op = ['include_vars', build_op[1], self._to_repository_path(build_op[2])]
+            recorded_build_ops.append(build_op)
+        self._build_files[repository_file_path] = {
+            'ops': recorded_build_ops,
+            'includes': [build_op[1] for build_op in recorded_build_ops if build_op[0] == 'include'],
+            'groups': [build_op[1] for build_op in recorded_build_ops if build_op[0] == 'group'],
+        }
+
+    def _replay_build(self, inventory, repository_file_path):
+        # include_vars files are read again rather than recorded, so a changed variable file never needs a rebuild
+        recorded_file = self._previous_build['files'][repository_file_path]
+        self._build_files[repository_file_path] = recorded_file
+        for build_op in recorded_file['ops']:
+            if build_op[0] == 'include':
+                self._replay_build(inventory, build_op[1])
+            elif build_op[0] == 'include_vars':
+                self._apply_build_op(inventory, ['include_vars', build_op[1], self._from_repository_path(build_op[2])])
+            else:
+                self._apply_build_op(inventory, build_op)
+
+    def _is_build_reusable(self, repository_file_path):
+        if self._previous_build is None:
+            return False
+        if repository_file_path not in self._reusable_builds:
+            recorded_file = self._previous_build['files'].get(repository_file_path)
+            # files outside the repository are not covered by the diff between commits
+            self._reusable_builds[repository_file_path] = (
+                recorded_file is not None
+                and not posixpath.isabs(repository_file_path) and repository_file_path.split('/')[0] != '..'
+                and repository_file_path not in self._previous_build['changed_paths']
+                and all(self._is_build_reusable(include_file_path) for include_file_path in recorded_file['includes'])
+            )
+        return self._reusable_builds[repository_file_path]
+
+    def _to_repository_path(self, file_path):
+        if self._git_object_reads:
+            return posixpath.normpath(file_path)
+        return os.path.relpath(file_path, self._git_repo_path)
+
+    def _from_repository_path(self, repository_file_path):
+        if self._git_object_reads:
+            return repository_file_path
+        return os.path.join(self._git_repo_path, repository_file_path)
+
+    def _populate_direct(self, inventory_file_path, inventory_name):
+        # the build ops are applied to the Ansible inventory as the files are read, without building the inventory dictionary
+        self._recording_build = False
+        try:
+            self._build_file(inventory_file_path, self.inventory, inventory_name)
+            for definition, child_group in self._direct_pending_children:
+                # still a loop once every file is read, fails the same as with populate_mode build
+                self.inventory.add_child(definition['group'].name, child_group.name)
+        finally:
+            self._direct_definitions, self._direct_host_definitions, self._direct_host_vars_before = {}, {}, {}
+            self._direct_created_groups, self._direct_created_hosts = set(), set()
+            self._direct_pending_children = []
+
+    def _apply_direct_op(self, build_op):
+        op_name, group_name = build_op[0], build_op[1]
+        if op_name == 'group':
+            self._define_direct_group(group_name)
+            return
+        definition = self._direct_definitions[group_name]
+        group = definition['group']
+        if op_name == 'child':
+            child_name = build_op[2]
+            if child_name not in self.inventory.groups:
+                self._direct_created_groups.add(child_name)
+            self._add_direct_child(definition, self.inventory.groups[self._add_group(child_name)])
+        elif op_name == 'host':
+            hosts, port = self._parse_host(build_op[2])
+            for host in hosts:
+                if host not in self.inventory.hosts:
+                    self._direct_created_hosts.add(host)
+                if host not in group.host_names:
+                    self.inventory.add_host(host, group=group.name, port=port)
+                    definition['added_hosts'].append(self.inventory.hosts[host])
+                if host in definition['hosts']:
+                    # a host given again in the same group replaces its earlier variables
+                    self._unset_direct_host_vars(definition, self.inventory.hosts[host])
+                self._set_direct_host_vars(definition, self.inventory.hosts[host], build_op[3])
+        elif op_name in ('vars', 'include_vars'):
+            group_vars = build_op[2] if op_name == 'vars' else self._read_variable_file(build_op[2])
+            group_vars_before = definition['group_vars_before'][0]
+            for var_name, var_value in group_vars.items():
+                # a later vars block replaces a variable of an earlier one as a whole, the same as the flattened vars of populate_mode build
+                if var_name in group_vars_before:
+                    group.vars[var_name] = group_vars_before[var_name]
+                else:
+                    group.vars.pop(var_name, None)
+                self.inventory.set_variable(group.name, var_name, var_value)
+
+    def _define_direct_group(self, group_name):
+        group = self.inventory.groups[self._add_group(group_name)]
+        definition = self._direct_definitions.get(group_name)
+        if definition is None:
+            # groups are ordered by their first definition, as the inventory dictionary of populate_mode build is,
+            # and a group defined again is reset to its variables from before this load
+            group_order, group_vars_before = len(self._direct_definitions), (dict(group.vars), group.priority)
+        else:
+            group_order, group_vars_before = definition['order'], definition['group_vars_before']
+            self._undo_direct_group(definition)
+            pending_children, self._direct_pending_children = self._direct_pending_children, []
+            for pending_definition, child_group in pending_children:
+                if pending_definition is not definition:
+                    self._add_direct_child(pending_definition, child_group)
+        self._direct_definitions[group_name] = {
+            'group': group,
+            'order': group_order,
+            'group_vars_before': group_vars_before,
+            'children': [],
+            'hosts': {},
+            'added_hosts': [],
+        }
+
+    def _add_direct_child(self, definition, child_group):
+        group = definition['group']
+        if child_group is group or child_group in group.get_ancestors():
+            self._direct_pending_children.append((definition, child_group))
+        elif child_group not in group.child_groups:
+            self.inventory.add_child(group.name, child_group.name)
+            definition['children'].append(child_group)
+
+    def _undo_direct_group(self, definition):
+        # a group defined again replaces its earlier definition, so remove what the earlier definition added
+        group = definition['group']
+        self.log("Replacing earlier definition of host group %s", group.name)
+        for host in list(definition['hosts']):
+            self._unset_direct_host_vars(definition, self.inventory.hosts[host])
+        for host_object in definition['added_hosts']:
+            group.remove_host(host_object)
+            self._reset_host_groups(host_object)
+            if host_object.name in self._direct_created_hosts and not host_object.get_groups():
+                self.inventory.remove_host(host_object)
+                self._direct_created_hosts.discard(host_object.name)
+        for child_group in definition['children']:
+            group.child_groups.remove(child_group)
+            child_group.parent_groups.remove(group)
+            self._reset_group_depth(child_group)
+            for host_object in child_group.get_hosts():
+                self._reset_host_groups(host_object)
+            # a group the load created only as a child of other groups is removed with its last parent
+            if child_group.name in self._direct_created_groups and child_group.name not in self._direct_definitions and not child_group.parent_groups:
+                self.inventory.remove_group(child_group.name)
+                self._direct_created_groups.discard(child_group.name)
+        group.clear_hosts_cache()
+        group.vars = dict(definition['group_vars_before'][0])
+        group.priority = definition['group_vars_before'][1]
+
+    def _set_direct_host_vars(self, definition, host_object, host_vars):
+        for var_name, var_value in (host_vars or {}).items():
+            last_definition = self._get_last_direct_host_var_definition(host_object.name, var_name)
+            if last_definition is None and var_name in host_object.vars:
+                # a value from before this load, such as from an earlier source, is set again once no group gives the variable
+                self._direct_host_vars_before.setdefault((host_object.name, var_name), host_object.vars[var_name])
+            # host variables are set group by group in group order with populate_mode build, so the last group in group order wins
+            if last_definition is None or last_definition['order'] < definition['order']:
+                self.inventory.set_variable(host_object.name, var_name, var_value)
+        self._direct_host_definitions.setdefault(host_object.name, []).append(definition)
+        definition['hosts'][host_object.name] = host_vars
+
+    def _unset_direct_host_vars(self, definition, host_object):
+        host_vars = definition['hosts'].pop(host_object.name)
+        self._direct_host_definitions[host_object.name].remove(definition)
+        for var_name in host_vars or {}:
+            last_definition = self._get_last_direct_host_var_definition(host_object.name, var_name)
+            if last_definition is not None:
+                host_object.vars[var_name] = last_definition['hosts'][host_object.name][var_name]
+            elif (host_object.name, var_name) in self._direct_host_vars_before:
+                host_object.vars[var_name] = self._direct_host_vars_before[(host_object.name, var_name)]
+            else:
+                host_object.vars.pop(var_name, None)
+
+    def _get_last_direct_host_var_definition(self, host, var_name):
+        last_definition = None
+        for definition in self._direct_host_definitions.get(host, []):
+            if var_name in (definition['hosts'][host] or {}) and (last_definition is None or definition['order'] > last_definition['order']):
+                last_definition = definition
+        return last_definition
+
+    def _reset_host_groups(self, host_object):
+        # the groups of a host are the groups holding it and their ancestors,
+        # Host.remove_group also drops groups holding the host when they are ancestors of the removed group
+        host_object.groups = [host_group for host_group in self.inventory.groups.values() if host_object.name in host_group.host_names]
+        host_object.populate_ancestors()
+
+    def _reset_group_depth(self, group):
+        group.depth = max([parent_group.depth + 1 for parent_group in group.parent_groups], default=0)
+        for child_group in group.child_groups:
+            self._reset_group_depth(child_group)
+
+    def _add_group(self, group):
+        try:
+            return self.inventory.add_group(group)
+        except AnsibleError as e:
+            raise AnsibleParserError("Unable to add group %s: %s" % (group, to_text(e)))
+
+    def _add_group_vars_layer(self, host_group, group_vars):
+        # vars blocks are stacked instead of copied and merged one by one,
+        # _flatten_group_vars applies them in order once the inventory is built
+        if 'vars' not in host_group:
+            host_group['vars'] = ChainMap()
+        host_group['vars'].maps.insert(0, group_vars)
+
+    def _flatten_group_vars(self, inventory):
+        # later vars layers replace same named variables of earlier layers, the same as successive dict.update() calls
+        for host_group in inventory.values():
+            if isinstance(host_group.get('vars'), ChainMap):
+                host_group_vars = {}
+                for group_vars in reversed(host_group['vars'].maps):
+                    host_group_vars.update(group_vars)
+                host_group['vars'] = host_group_vars
+        return inventory
+
     def _json_format_dict(self, inventory, pretty=False):
         # convert inventory dictionary to json string
         if pretty:
@@ -331,35 +1864,24 @@ class InventoryModule(BaseInventoryPlugin):  # TODO: implement Cacheable
 
     def _find_host_vars(self, host, inventory):
         # per ansible inventory spec, default host vars is empty dictionary
-        host_vars = dict()
         if len(inventory) == 0:
-            return host_vars
-
-        for group_name, host_group in inventory.iteritems():
-            host_match = False
-            # if the host group name matches or a host in this group matches
-            if group_name == host:
-                host_match = True
+            return dict()
+        try:
+            return self._get_inventory_index(inventory).host_vars(host)
+        except AnsibleError:
+            return dict()
 
-            if 'hosts' in host_group:
-                # TODO: host pattern matching?
-                if host in host_group['hosts']:
-                    host_match = True
-
-            if 'vars' in host_group and host_match:
-                # add this host group vars to the variables to return
-                host_vars.update(host_group['vars'])
-
-        return host_vars
+    def _get_inventory_index(self, inventory):
+        # indexed once per built inventory
+        if self._inventory_index is None or self._inventory_index.inventory is not inventory:
+            self._inventory_index = InventoryIndex(inventory, self._parse_host)
+        return self._inventory_index
 
     def _parse_group(self, group, group_data):
 
         if isinstance(group_data, (MutableMapping, NoneType)):
 
-            try:
-                group = self.inventory.add_group(group)
-            except AnsibleError as e:
-                raise AnsibleParserError("Unable to add group %s: %s" % (group, to_text(e)))
+            group = self._add_group(group)
 
             if group_data is not None:
                 # make sure they are dicts
@@ -414,3 +1936,69 @@ class InventoryModule(BaseInventoryPlugin):  # TODO: implement Cacheable
         (hostnames, port) = self._expand_hostpattern(host_pattern)
 
         return hostnames, port
+
+
+def main(argv=None):
+    ''' compile git inventory configs into snapshots the plugin loads with compiled_inventory_path, query their inventory,
+        and refresh repository caches '''
+    parser = argparse.ArgumentParser(prog=f"python -m {CLI_MODULE_NAME}",
+                                     description='Compile spatiumcepa.platform.git inventory configs')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    compile_parser = subparsers.add_parser('compile', help='build the inventory of a config and write it as a compiled inventory snapshot')
+    compile_parser.add_argument('config', help='spatiumcepa.platform.git inventory config file with git_url')
+    compile_parser.add_argument('--commit', help='commit, branch, or tag to compile instead of the config commit')
+    compile_parser.add_argument('--file-path', help='inventory file to compile instead of the config file_path')
+    compile_parser.add_argument('--output-dir', help='directory to write the snapshot to, compiled in git_repo_cache_dir by default')
+    list_parser = subparsers.add_parser('list', help='output the inventory of a config as JSON, like ansible-inventory --list')
+    list_parser.add_argument('config', help='spatiumcepa.platform.git inventory config file, loaded from its compiled_inventory_path when set')
+    host_parser = subparsers.add_parser('host', help='output the variables of hosts as JSON, like ansible-inventory --host')
+    host_parser.add_argument('config', help='spatiumcepa.platform.git inventory config file, loaded from its compiled_inventory_path when set')
+    host_parser.add_argument('hosts', nargs='+', metavar='host', help='host to output, the variables of each are keyed by host when more than one is given')
+    refresh_parser = subparsers.add_parser('refresh', help='fetch commit of a git repository into its repository cache, '
+                                           'as git_repo_cache_stale_while_revalidate does in the background')
+    refresh_parser.add_argument('git_url', help='git URL of the repository')
+    refresh_parser.add_argument('--commit', default='master', help='commit, branch, or tag to fetch')
+    refresh_parser.add_argument('--git-repo-cache-dir', required=True, help='git_repo_cache_dir holding the repository cache')
+    refresh_parser.add_argument('--ssh-key', help='SSH identity file to use for git operations')
+    refresh_parser.add_argument('--git-clone-depth', type=int, help='fetch commit with history truncated to this many commits')
+    refresh_parser.add_argument('--git-clone-filter', help='partial clone filter spec')
+    refresh_parser.add_argument('--update-time-seconds', type=int, default=0, help='only fetch when commit was fetched longer ago than this')
+    args = parser.parse_args(argv)
+
+    from ansible import constants as C
+    from ansible.cli import CLI
+    from ansible.parsing.ajson import AnsibleJSONEncoder
+    from ansible.parsing.dataloader import DataLoader
+    from ansible.plugins.loader import inventory_loader
+    # python -m imports this collection without the Ansible collection loader, which can then no longer load it,
+    # so the plugin options are registered from this module the way the plugin loader would
+    inventory_loader._load_config_defs(InventoryModule.NAME, sys.modules[__name__], __file__)
+    plugin = InventoryModule()
+    plugin._load_name = InventoryModule.NAME
+    plugin._redirected_names = [InventoryModule.NAME]
+    loader = DataLoader()
+    try:
+        if args.command == 'compile':
+            print(plugin.compile_inventory(loader, args.config, output_dir=args.output_dir, commit=args.commit, file_path=args.file_path))
+            return
+        if args.command == 'refresh':
+            plugin.refresh_repository(args.git_url, args.commit, args.git_repo_cache_dir, ssh_key=args.ssh_key, git_clone_depth=args.git_clone_depth,
+                                      git_clone_filter=args.git_clone_filter, update_time_seconds=args.update_time_seconds)
+            return
+        # vault secrets are only needed for files vault encrypted as a whole, !vault values are output as ciphertext
+        loader.set_vault_secrets(CLI.setup_vault_secrets(loader, C.DEFAULT_VAULT_IDENTITY_LIST, auto_prompt=False))
+        inventory_index = plugin.load_inventory_index(loader, args.config)
+        if args.command == 'list':
+            query_result = inventory_index.list_inventory()
+        elif len(args.hosts) == 1:
+            query_result = inventory_index.host_vars(args.hosts[0])
+        else:
+            query_result = dict((host, inventory_index.host_vars(host)) for host in args.hosts)
+    except AnsibleError as e:
+        sys.exit(f"ERROR: {to_native(e)}")
+    print(json.dumps(query_result, cls=AnsibleJSONEncoder, sort_keys=True, indent=4))
+
+
+if __name__ == '__main__':
+    main()
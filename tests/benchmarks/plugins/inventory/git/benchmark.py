@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# git inventory plugin benchmark
+# Generate synthetic inventories in local bare git repositories, load them with the plugin
+# and report wall time and peak memory of each phase as JSON
+from __future__ import (absolute_import, division, print_function)
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+__metaclass__ = type
+
+COLLECTION_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', '..'))
+
+BENCHMARK_VAULT_ID = 'benchmark'
+BENCHMARK_VAULT_PASSWORD = b'benchmark'
+
+SCENARIOS = ('cold', 'warm', 'incremental')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the spatiumcepa.platform.git inventory plugin against synthetic inventories')
+    parser.add_argument('--groups', type=int, default=100, help='number of host groups')
+    parser.add_argument('--hosts-per-group', type=int, default=10, help='number of hosts in each host group')
+    parser.add_argument('--include-depth', type=int, default=2, help='depth of the includes tree below the root inventory file')
+    parser.add_argument('--include-fanout', type=int, default=4, help='number of files each inventory file includes')
+    parser.add_argument('--shared-vars-files', type=int, default=5, help='number of include_vars files shared by all host groups')
+    parser.add_argument('--vars-files-per-group', type=int, default=2, help='number of shared include_vars files each host group includes')
+    parser.add_argument('--var-payload-bytes', type=int, default=256, help='size of each generated variable value')
+    parser.add_argument('--vars-per-file', type=int, default=20, help='number of variables in each vars block and include_vars file')
+    parser.add_argument('--vault-values', type=int, default=1, help='number of !vault values in each shared include_vars file')
+    parser.add_argument('--vault-files', type=int, default=0, help='number of shared include_vars files that are vault encrypted as a whole')
+    parser.add_argument('--verify-incremental', action='store_true',
+                        help='check each incremental rebuild against a full rebuild, failing the benchmark when they differ')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace allocations to report the peak memory of each plugin phase, slowing every run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each scenario')
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                        help='plugin option to set in the generated inventory config, as YAML, may be given more than once')
+    parser.add_argument('--work-dir', help='directory for generated repositories and caches, a temporary directory by default')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--run-once', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def vault_encrypt(plaintext):
+    from ansible.parsing.vault import VaultLib, VaultSecret
+    vault = VaultLib([(BENCHMARK_VAULT_ID, VaultSecret(BENCHMARK_VAULT_PASSWORD))])
+    return vault.encrypt(plaintext, vault_id=BENCHMARK_VAULT_ID).decode()
+
+
+def yaml_vault_value(ciphertext):
+    return '!vault |\n' + ''.join('    ' + line + '\n' for line in ciphertext.splitlines())
+
+
+def write_vars(fh, prefix, args, indent=''):
+    payload = 'x' * args.var_payload_bytes
+    for var_index in range(args.vars_per_file):
+        fh.write(f"{indent}{prefix}_var_{var_index}: {payload}\n")
+
+
+def generate_inventory(args, source_path):
+    ''' write a synthetic inventory tree to source_path and return the number of inventory files written '''
+    vars_path = os.path.join(source_path, 'vars')
+    os.makedirs(vars_path)
+    ciphertext = vault_encrypt('benchmark secret')
+    for vars_index in range(args.shared_vars_files):
+        with open(os.path.join(vars_path, f"shared_{vars_index}.yml"), 'w') as fh:
+            fh.write('---\n')
+            write_vars(fh, f"shared_{vars_index}", args)
+            for vault_index in range(args.vault_values):
+                fh.write(f"shared_{vars_index}_vault_{vault_index}: {yaml_vault_value(ciphertext)}")
+        if vars_index < args.vault_files:
+            with open(os.path.join(vars_path, f"shared_{vars_index}.yml"), 'r+') as fh:
+                vars_text = fh.read()
+                fh.seek(0)
+                fh.truncate()
+                fh.write(vault_encrypt(vars_text))
+
+    # build the includes tree, host groups are spread over the leaf files
+    levels = [['inventory.yml']]
+    for depth in range(args.include_depth):
+        levels.append([f"level{depth}/{parent.split('/')[-1].split('.')[0]}_{fanout}.yml"
+                       for parent in levels[-1] for fanout in range(args.include_fanout)])
+    leaves = levels[-1]
+    leaf_groups = dict((leaf, []) for leaf in leaves)
+    for group_index in range(args.groups):
+        leaf_groups[leaves[group_index % len(leaves)]].append(group_index)
+
+    inventory_files = 0
+    for depth, level in enumerate(levels):
+        for file_name in level:
+            file_path = os.path.join(source_path, file_name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as fh:
+                fh.write('---\n')
+                fh.write('vars:\n')
+                write_vars(fh, file_name.split('/')[-1].split('.')[0], args, indent='  ')
+                if depth + 1 < len(levels):
+                    fh.write('includes:\n')
+                    for fanout in range(args.include_fanout):
+                        include = f"level{depth}/{file_name.split('/')[-1].split('.')[0]}_{fanout}.yml"
+                        fh.write(f"  - {os.path.relpath(include, os.path.dirname(file_name))}\n")
+                for group_index in leaf_groups.get(file_name, []):
+                    fh.write(f"group_{group_index}:\n")
+                    if args.shared_vars_files:
+                        fh.write('  include_vars:\n')
+                        for vars_offset in range(args.vars_files_per_group):
+                            vars_index = (group_index + vars_offset) % args.shared_vars_files
+                            fh.write(f"    - {os.path.relpath(os.path.join('vars', f'shared_{vars_index}.yml'), os.path.dirname(file_name))}\n")
+                    fh.write('  vars:\n')
+                    write_vars(fh, f"group_{group_index}", args, indent='    ')
+                    for host_index in range(args.hosts_per_group):
+                        fh.write(f"  host-{group_index}-{host_index}.example.com:\n")
+                        fh.write('    _aig_type: host\n')
+                        fh.write('    vars:\n')
+                        fh.write(f"      host_index: {host_index}\n")
+            inventory_files += 1
+    return inventory_files
+
+
+GIT_ENV = dict(GIT_AUTHOR_NAME='benchmark', GIT_AUTHOR_EMAIL='benchmark@example.com',
+               GIT_COMMITTER_NAME='benchmark', GIT_COMMITTER_EMAIL='benchmark@example.com')
+
+
+def create_repository(args, work_dir):
+    ''' commit a generated inventory to a bare repository and return its file:// url '''
+    source_path = os.path.join(work_dir, 'source')
+    bare_path = os.path.join(work_dir, 'inventory.git')
+    inventory_files = generate_inventory(args, source_path)
+    git_env = dict(os.environ, **GIT_ENV)
+    for git_args in (['init', '-q'], ['checkout', '-q', '-b', 'master'], ['add', '-A'], ['commit', '-q', '-m', 'benchmark inventory']):
+        subprocess.run(['git'] + git_args, cwd=source_path, env=git_env, check=True)
+    subprocess.run(['git', 'clone', '-q', '--bare', source_path, bare_path], check=True)
+    subprocess.run(['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=bare_path, check=True)
+    return 'file://' + bare_path, inventory_files
+
+
+def commit_inventory_change(args, work_dir, change_index):
+    ''' commit a new host group to one leaf inventory file and a new variable to one shared include_vars file, push to the bare repository '''
+    source_path = os.path.join(work_dir, 'source')
+    leaf_path = os.path.join(source_path, 'inventory.yml')
+    if args.include_depth:
+        leaf_dir = os.path.join(source_path, f"level{args.include_depth - 1}")
+        leaf_path = os.path.join(leaf_dir, sorted(os.listdir(leaf_dir))[-1])
+    with open(leaf_path, 'a') as fh:
+        fh.write(f"changed_{change_index}:\n")
+        fh.write('  vars:\n')
+        write_vars(fh, f"changed_{change_index}", args, indent='    ')
+    # whole file vault encrypted vars files are the first vault_files shared vars files
+    if args.shared_vars_files > args.vault_files:
+        with open(os.path.join(source_path, 'vars', f"shared_{args.shared_vars_files - 1}.yml"), 'a') as fh:
+            fh.write(f"changed_var_{change_index}: {change_index}\n")
+    git_env = dict(os.environ, **GIT_ENV)
+    subprocess.run(['git', 'commit', '-q', '-a', '-m', f"benchmark change {change_index}"], cwd=source_path, env=git_env, check=True)
+    subprocess.run(['git', 'push', '-q', os.path.join(work_dir, 'inventory.git'), 'master'], cwd=source_path, env=git_env, check=True)
+
+
+def write_config(args, work_dir, git_url, cache_dir, scenario_name, options=()):
+    config_path = os.path.join(work_dir, f"{scenario_name}.git.yml")
+    with open(config_path, 'w') as fh:
+        fh.write('---\n')
+        fh.write('plugin: spatiumcepa.platform.git\n')
+        fh.write(f"git_url: {git_url}\n")
+        fh.write('file_path: inventory.yml\n')
+        fh.write(f"git_repo_cache_dir: {cache_dir}\n")
+        for option in list(options) + args.option:
+            option_name, option_value = option.split('=', 1)
+            fh.write(f"{option_name}: {option_value}\n")
+    return config_path
+
+
+class PhaseMemoryTracer:
+    ''' track the allocation peak of each plugin phase, above what was allocated when the phase started '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open_frames = []
+        self.phase_peaks = {}
+
+    def fold_peak(self):
+        # the traced peak is process wide, so it is kept by every phase in progress before it is reset for the next phase
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        for open_frame in self.open_frames:
+            open_frame['peak'] = max(open_frame['peak'], traced_peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def traced(self, phase):
+        with self.lock:
+            self.fold_peak()
+            traced_bytes = tracemalloc.get_traced_memory()[0]
+            frame = {'start': traced_bytes, 'peak': traced_bytes}
+            self.open_frames.append(frame)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.fold_peak()
+                self.open_frames = [open_frame for open_frame in self.open_frames if open_frame is not frame]
+                self.phase_peaks[phase] = max(self.phase_peaks.get(phase, 0), frame['peak'] - frame['start'])
+
+    def patch(self, inventory_module_class):
+        ''' trace the phases the plugin profiles, parse is timed around the methods loading each file '''
+        tracer = self
+        timed = inventory_module_class._timed
+
+        @contextmanager
+        def traced_timed(plugin, phase):
+            with tracer.traced(phase), timed(plugin, phase):
+                yield
+        inventory_module_class._timed = traced_timed
+
+        for load_method_name in ('_load_inventory_data', '_load_variable_data'):
+            def traced_load(plugin, *args, load_method=getattr(inventory_module_class, load_method_name)):
+                with tracer.traced('parse'):
+                    return load_method(plugin, *args)
+            setattr(inventory_module_class, load_method_name, traced_load)
+
+
+def run_once(config_path, trace_memory=False):
+    ''' load the inventory in this process, print wall time, peak memory and the plugin profile as JSON '''
+    from ansible.inventory.manager import InventoryManager
+    from ansible.parsing.dataloader import DataLoader
+    from ansible.parsing.vault import VaultSecret
+
+    profile_path = config_path + '.profile.jsonl'
+    if os.path.exists(profile_path):
+        os.remove(profile_path)
+    os.environ['ANSIBLE_INVENTORY_GIT_PROFILE'] = profile_path
+
+    loader = DataLoader()
+    loader.set_vault_secrets([(BENCHMARK_VAULT_ID, VaultSecret(BENCHMARK_VAULT_PASSWORD))])
+    if trace_memory:
+        from ansible.plugins.loader import inventory_loader
+        phase_memory_tracer = PhaseMemoryTracer()
+        phase_memory_tracer.patch(inventory_loader.get('spatiumcepa.platform.git', class_only=True))
+        tracemalloc.start()
+    start = time.perf_counter()
+    inventory = InventoryManager(loader=loader, sources=[config_path])
+    wall_seconds = time.perf_counter() - start
+    if trace_memory:
+        tracemalloc.stop()
+
+    with open(profile_path) as pfh:
+        profile = json.loads(pfh.readlines()[-1])
+    result = {
+        'wall_seconds': wall_seconds,
+        # ru_maxrss is in kilobytes on Linux, and covers the whole process including importing ansible
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'groups': len(inventory.groups),
+        'hosts': len(inventory.hosts),
+        'phases': dict((phase, timing['seconds']) for phase, timing in profile['phases'].items()),
+    }
+    if trace_memory:
+        result['phase_peak_kb'] = dict((phase, peak_bytes // 1024) for phase, peak_bytes in phase_memory_tracer.phase_peaks.items())
+    print(json.dumps(result))
+
+
+def run_scenario(args, config_path, env):
+    run_args = [sys.executable, os.path.abspath(__file__), '--run-once', config_path]
+    if args.trace_memory:
+        run_args.append('--trace-memory')
+    completed = subprocess.run(run_args, env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def summarize(runs):
+    summary = {
+        'wall_seconds': statistics.median(run['wall_seconds'] for run in runs),
+        'peak_rss_kb': max(run['peak_rss_kb'] for run in runs),
+        'phases': {},
+    }
+    for phase in sorted(set(phase for run in runs for phase in run['phases'])):
+        summary['phases'][phase] = statistics.median(run['phases'].get(phase, 0.0) for run in runs)
+    if any('phase_peak_kb' in run for run in runs):
+        summary['phase_peak_kb'] = {}
+        for phase in sorted(set(phase for run in runs for phase in run.get('phase_peak_kb', {}))):
+            summary['phase_peak_kb'][phase] = max(run.get('phase_peak_kb', {}).get(phase, 0) for run in runs)
+    return summary
+
+
+def collection_version():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=COLLECTION_PATH, check=True,
+                              stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.trace_memory and not hasattr(tracemalloc, 'reset_peak'):
+        sys.exit('--trace-memory needs tracemalloc.reset_peak, added in python 3.9')
+    if args.run_once:
+        run_once(args.run_once, args.trace_memory)
+        return
+
+    import ansible
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='inventory-git-benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        # make this collection checkout importable as spatiumcepa.platform
+        collections_path = os.path.join(work_dir, 'collections')
+        os.makedirs(os.path.join(collections_path, 'ansible_collections', 'spatiumcepa'), exist_ok=True)
+        collection_link = os.path.join(collections_path, 'ansible_collections', 'spatiumcepa', 'platform')
+        if not os.path.exists(collection_link):
+            os.symlink(COLLECTION_PATH, collection_link)
+        env = dict(os.environ, ANSIBLE_COLLECTIONS_PATH=collections_path,
+                   ANSIBLE_INVENTORY_ENABLED='spatiumcepa.platform.git', ANSIBLE_INVENTORY_ANY_UNPARSED_IS_FAILED='True')
+
+        git_url, inventory_files = create_repository(args, work_dir)
+
+        scenarios = dict((scenario, []) for scenario in SCENARIOS)
+        for run_index in range(args.repeat):
+            cache_dir = os.path.join(work_dir, f"cache-{run_index}")
+            config_path = write_config(args, work_dir, git_url, cache_dir, f"run-{run_index}")
+            # cold starts from an empty repository cache, warm reuses the cache the cold run left behind
+            scenarios['cold'].append(run_scenario(args, config_path, env))
+            scenarios['warm'].append(run_scenario(args, config_path, env))
+
+            # incremental records a build, then rebuilds it after a commit changing one leaf inventory file and one vars file
+            incremental_options = ['incremental_rebuild=true', 'git_repo_cache_update_time_seconds=0']
+            if args.verify_incremental:
+                incremental_options.append('incremental_rebuild_verify=true')
+            config_path = write_config(args, work_dir, git_url, os.path.join(work_dir, f"incremental-cache-{run_index}"),
+                                       f"incremental-{run_index}", incremental_options)
+            run_scenario(args, config_path, env)
+            commit_inventory_change(args, work_dir, run_index)
+            scenarios['incremental'].append(run_scenario(args, config_path, env))
+
+        report = {
+            'time': time.time(),
+            'collection_commit': collection_version(),
+            'python_version': platform.python_version(),
+            'ansible_version': ansible.__version__,
+            'parameters': dict((name, value) for name, value in vars(args).items()
+                               if name not in ('work_dir', 'output', 'run_once')),
+            'inventory_files': inventory_files,
+            'groups': scenarios['cold'][0]['groups'],
+            'hosts': scenarios['cold'][0]['hosts'],
+            'scenarios': dict((scenario, summarize(runs)) for scenario, runs in scenarios.items()),
+            'runs': scenarios,
+        }
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    report_json = json.dumps(report, sort_keys=True, indent=2)
+    if args.output:
+        with open(args.output, 'w') as ofh:
+            ofh.write(report_json + '\n')
+    else:
+        print(report_json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,714 @@
+#!/usr/bin/env python
+# git inventory plugin checks
+# Commit inventories to local bare git repositories, load them through file:// with ansible-inventory
+# and check behaviour that needs a repository, exits non-zero when any check fails
+from __future__ import (absolute_import, division, print_function)
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+__metaclass__ = type
+
+CLI_MODULE_NAME = 'ansible_collections.spatiumcepa.platform.plugins.inventory.git'
+
+COLLECTION_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..'))
+
+CHECKS_VAULT_ID = 'checks'
+CHECKS_VAULT_PASSWORD = 'checks'
+
+CONCURRENT_LOADS = 50
+
+FETCH_TIME_CHECK_UPDATE_SECONDS = 2
+
+# an inventory reaching files in several directories, next to a directory it never reads
+LAYOUT_FILES = {
+    'inventory.yml': '---\ninclude_vars:\n  - vars/shared.yml\nvars:\n  root_var: root\nincludes:\n  - datacenters/dc1.yml\n',
+    'datacenters/dc1.yml': '---\ndc1:\n  include_vars:\n    - ../vars/dc1.yml\n  web1:\n    _aig_type: host\n    vars:\n      host_var: web1\n',
+    'vars/shared.yml': '---\nshared_var: shared\n',
+    'vars/dc1.yml': '---\ndc_var: dc1\n',
+    'unrelated/other.yml': '---\nother:\n  other1:\n    _aig_type: host\n',
+}
+
+GIT_ENV = dict(GIT_AUTHOR_NAME='checks', GIT_AUTHOR_EMAIL='checks@example.com',
+               GIT_COMMITTER_NAME='checks', GIT_COMMITTER_EMAIL='checks@example.com')
+
+CHECKS = {}
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def check(check_function):
+    CHECKS[check_function.__name__[len('check_'):]] = check_function
+    return check_function
+
+
+def vault_encrypt(plaintext):
+    from ansible.parsing.vault import VaultLib, VaultSecret
+    vault = VaultLib([(CHECKS_VAULT_ID, VaultSecret(CHECKS_VAULT_PASSWORD.encode()))])
+    return vault.encrypt(plaintext, vault_id=CHECKS_VAULT_ID).decode()
+
+
+def write_files(path, files):
+    for file_name, file_content in files.items():
+        file_path = os.path.join(path, file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as fh:
+            fh.write(file_content)
+
+
+def git(args, cwd):
+    return subprocess.run(['git'] + args, cwd=cwd, env=dict(os.environ, **GIT_ENV), check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+
+def create_repository(work_dir, files):
+    ''' commit files to a source repository, clone it to a bare repository and return the source path and file:// url '''
+    source_path = os.path.join(work_dir, 'source')
+    bare_path = os.path.join(work_dir, 'inventory.git')
+    write_files(source_path, files)
+    for git_args in (['init', '-q'], ['checkout', '-q', '-b', 'master'], ['add', '-A'], ['commit', '-q', '-m', 'checks inventory']):
+        git(git_args, source_path)
+    git(['clone', '-q', '--bare', source_path, bare_path], work_dir)
+    return source_path, 'file://' + bare_path
+
+
+def commit_files(source_path, files, message, branch='master'):
+    ''' commit files to branch of the source repository, created from the current branch if needed, and push it to the bare repository '''
+    branch_exists = subprocess.run(['git', 'rev-parse', '-q', '--verify', f"refs/heads/{branch}"], cwd=source_path, stdout=subprocess.DEVNULL).returncode == 0
+    git(['checkout', '-q'] + ([] if branch_exists else ['-b']) + [branch], source_path)
+    write_files(source_path, files)
+    git(['add', '-A'], source_path)
+    git(['commit', '-q', '-m', message], source_path)
+    git(['push', '-q', os.path.join(os.path.dirname(source_path), 'inventory.git'), branch], source_path)
+
+
+def write_config(work_dir, config_name, options):
+    config_path = os.path.join(work_dir, f"{config_name}.git.yml")
+    with open(config_path, 'w') as fh:
+        fh.write('---\n')
+        fh.write('plugin: spatiumcepa.platform.git\n')
+        for option_name, option_value in options.items():
+            fh.write(f"{option_name}: {option_value}\n")
+    return config_path
+
+
+def ansible_inventory(config_path, env, *args):
+    ''' run ansible-inventory on config_path and return its output '''
+    ansible_inventory_path = os.path.join(os.path.dirname(sys.executable), 'ansible-inventory')
+    if not os.path.exists(ansible_inventory_path):
+        ansible_inventory_path = 'ansible-inventory'
+    completed = subprocess.run([ansible_inventory_path, '-i', config_path] + list(args), env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if completed.returncode != 0:
+        raise CheckFailed(f"ansible-inventory -i {config_path} {' '.join(args)} failed:\n{completed.stdout}")
+    return completed.stdout
+
+
+def run_cli(env, *args):
+    ''' run the plugin command line entry point, return its exit code and output '''
+    cli_env = dict(env, PYTHONPATH=env['ANSIBLE_COLLECTIONS_PATH'])
+    # run from / so no directory of this checkout shadows an import
+    completed = subprocess.run([sys.executable, '-m', CLI_MODULE_NAME] + list(args), env=cli_env, cwd='/',
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return completed.returncode, completed.stdout, completed.stderr
+
+
+def vault_value(plaintext, indent):
+    ''' a !vault YAML value, its ciphertext lines indented by indent '''
+    return '!vault |\n' + ''.join(indent + line + '\n' for line in vault_encrypt(plaintext).splitlines())
+
+
+def find_in_files(path, text):
+    ''' files under path that contain text '''
+    found_file_paths = []
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            with open(file_path, 'rb') as fh:
+                if text.encode() in fh.read():
+                    found_file_paths.append(file_path)
+    return found_file_paths
+
+
+@check
+def check_inventory_cache_vault_files(work_dir, env):
+    ''' the inventory cache never holds the content of include_vars files vault encrypted as a whole '''
+    plaintext = 'checks_whole_file_vault_plaintext'
+    source_path, git_url = create_repository(work_dir, {
+        'vault.yml': '---\ninclude_vars:\n  - vault_vars.yml\nvars:\n  plain_var: plain\nhost1:\n  _aig_type: host\n',
+        'plain.yml': '---\nvars:\n  plain_var: plain\nhost1:\n  _aig_type: host\n',
+        'vault_vars.yml': vault_encrypt(f"---\nwhole_file_secret: {plaintext}\n"),
+    })
+    cache_connection = os.path.join(work_dir, 'inventory-cache')
+    inventory_lists = {}
+    for config_name in ('vault', 'plain'):
+        config_path = write_config(work_dir, config_name, {
+            'git_url': git_url,
+            'file_path': f"{config_name}.yml",
+            'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+            'cache': 'true',
+            'cache_plugin': 'jsonfile',
+            'cache_connection': os.path.join(cache_connection, config_name),
+        })
+        # the second load reads the inventory cache when the first one wrote it
+        for _ in range(2):
+            inventory_lists[config_name] = ansible_inventory(config_path, env, '--list')
+    if plaintext not in inventory_lists['vault']:
+        raise CheckFailed(f"vault_vars.yml was not decrypted:\n{inventory_lists['vault']}")
+    if not os.listdir(os.path.join(cache_connection, 'plain')):
+        raise CheckFailed('the inventory of plain.yml was not cached')
+    found_file_paths = find_in_files(work_dir, plaintext)
+    if found_file_paths:
+        raise CheckFailed(f"decrypted content of vault_vars.yml written to {', '.join(found_file_paths)}")
+
+
+@check
+def check_delete_repo_cache_concurrent_loads(work_dir, env):
+    ''' concurrent loads with delete_repo_cache never remove the repository cache another load is reading '''
+    inventory_groups = ''.join(f"group{group_index}:\n  host{group_index}:\n    _aig_type: host\n" for group_index in range(50))
+    _, git_url = create_repository(work_dir, {'inventory.yml': '---\nvars:\n  plain_var: plain\n' + inventory_groups})
+    config_path = write_config(work_dir, 'inventory', {
+        'git_url': git_url,
+        'file_path': 'inventory.yml',
+        'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+        'delete_repo_cache': 'true',
+    })
+    with ThreadPoolExecutor(max_workers=CONCURRENT_LOADS) as executor:
+        load_futures = [executor.submit(ansible_inventory, config_path, env, '--list') for _ in range(CONCURRENT_LOADS)]
+        failures = []
+        for load_future in load_futures:
+            try:
+                load_future.result()
+            except CheckFailed as e:
+                failures.append(str(e))
+    if failures:
+        raise CheckFailed(f"{len(failures)} of {CONCURRENT_LOADS} concurrent loads failed, the first with:\n{failures[0]}")
+
+
+@check
+def check_snapshot_prune_concurrent_loads(work_dir, env):
+    ''' concurrent loads of two commits never prune the snapshot another load is reading '''
+    inventory_groups = ''.join(f"group{group_index}:\n  host{group_index}:\n    _aig_type: host\n" for group_index in range(50))
+    source_path, git_url = create_repository(work_dir, {'inventory.yml': '---\nvars:\n  branch_var: master\n' + inventory_groups})
+    commit_files(source_path, {'inventory.yml': '---\nvars:\n  branch_var: dev\n' + inventory_groups}, 'dev branch', branch='dev')
+    config_paths = []
+    for branch in ('master', 'dev'):
+        config_paths.append(write_config(work_dir, branch, {
+            'git_url': git_url,
+            'commit': branch,
+            'file_path': 'inventory.yml',
+            'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+            # every snapshot is old enough to prune as soon as a load creates another one
+            'git_repo_cache_snapshot_max_age_seconds': 0,
+        }))
+    with ThreadPoolExecutor(max_workers=CONCURRENT_LOADS) as executor:
+        load_futures = [executor.submit(ansible_inventory, config_paths[load_index % 2], env, '--list') for load_index in range(CONCURRENT_LOADS)]
+        failures = []
+        for load_future in load_futures:
+            try:
+                load_future.result()
+            except CheckFailed as e:
+                failures.append(str(e))
+    if failures:
+        raise CheckFailed(f"{len(failures)} of {CONCURRENT_LOADS} concurrent loads failed, the first with:\n{failures[0]}")
+
+
+@check
+def check_fetch_time_per_ref(work_dir, env):
+    ''' a ref is refreshed once it is older than git_repo_cache_update_time_seconds, whichever other refs were refreshed since '''
+    source_path, git_url = create_repository(work_dir, {'inventory.yml': '---\nvars:\n  branch_var: master\nhost1:\n  _aig_type: host\n'})
+    commit_files(source_path, {'inventory.yml': '---\nvars:\n  branch_var: dev\nhost1:\n  _aig_type: host\n'}, 'dev branch', branch='dev')
+    config_paths = {}
+    for branch in ('master', 'dev'):
+        config_paths[branch] = write_config(work_dir, branch, {
+            'git_url': git_url,
+            'commit': branch,
+            'file_path': 'inventory.yml',
+            'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+            'git_repo_cache_update_time_seconds': FETCH_TIME_CHECK_UPDATE_SECONDS,
+        })
+        ansible_inventory(config_paths[branch], env, '--list')
+    commit_files(source_path, {'inventory.yml': '---\nvars:\n  branch_var: dev_updated\nhost1:\n  _aig_type: host\n'}, 'update dev', branch='dev')
+    time.sleep(FETCH_TIME_CHECK_UPDATE_SECONDS + 0.5)
+    # refreshing master must not count as refreshing dev
+    ansible_inventory(config_paths['master'], env, '--list')
+    dev_host_vars = ansible_inventory(config_paths['dev'], env, '--host', 'host1')
+    if 'dev_updated' not in dev_host_vars:
+        raise CheckFailed(f"dev was not refreshed after a refresh of master:\n{dev_host_vars}")
+
+
+@check
+def check_stale_while_revalidate(work_dir, env):
+    ''' a stale repository cache is used at once and refreshed in the background for the next load '''
+    source_path, git_url = create_repository(work_dir, {'inventory.yml': '---\nvars:\n  refresh_var: first\nhost1:\n  _aig_type: host\n'})
+    config_path = write_config(work_dir, 'inventory', {
+        'git_url': git_url,
+        'file_path': 'inventory.yml',
+        'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+        'git_repo_cache_update_time_seconds': 1,
+        'git_repo_cache_stale_while_revalidate': 'true',
+    })
+    ansible_inventory(config_path, env, '--list')
+    commit_files(source_path, {'inventory.yml': '---\nvars:\n  refresh_var: refreshed\nhost1:\n  _aig_type: host\n'}, 'update')
+    time.sleep(1.5)
+    host_vars = ansible_inventory(config_path, env, '--host', 'host1')
+    if 'refreshed' in host_vars:
+        raise CheckFailed(f"the stale repository cache was refreshed before loading:\n{host_vars}")
+    refresh_deadline = time.time() + 30
+    while 'refreshed' not in host_vars:
+        if time.time() > refresh_deadline:
+            raise CheckFailed(f"the repository cache was not refreshed in the background:\n{host_vars}")
+        time.sleep(0.5)
+        host_vars = ansible_inventory(config_path, env, '--host', 'host1')
+
+
+@check
+def check_incremental_rebuild(work_dir, env):
+    ''' an incremental rebuild after a leaf file change, a new include and a root file change matches a full rebuild '''
+    source_path, git_url = create_repository(work_dir, {
+        'inventory.yml': '---\ninclude_vars:\n  - vars.yml\nvars:\n  root_var: first\nincludes:\n  - leaf.yml\n',
+        'vars.yml': '---\nshared_var: shared\n',
+        'leaf.yml': '---\nleaf_group:\n  vars:\n    leaf_var: first\n  host1:\n    _aig_type: host\n',
+    })
+    config_paths = {}
+    for config_name, options in (('incremental', {'incremental_rebuild': 'true', 'incremental_rebuild_verify': 'true'}), ('full', {})):
+        config_paths[config_name] = write_config(work_dir, config_name, dict({
+            'git_url': git_url,
+            'file_path': 'inventory.yml',
+            'git_repo_cache_dir': os.path.join(work_dir, f"repo-cache-{config_name}"),
+            'git_repo_cache_update_time_seconds': 0,
+        }, **options))
+    # the first load records the build the later loads rebuild from
+    ansible_inventory(config_paths['incremental'], env, '--list')
+    changes = (
+        ('leaf file change', {'leaf.yml': '---\nleaf_group:\n  vars:\n    leaf_var: changed\n  host1:\n    _aig_type: host\n'}, 'changed'),
+        ('new include', {
+            'leaf.yml': '---\nincludes:\n  - new_leaf.yml\nleaf_group:\n  vars:\n    leaf_var: changed\n  host1:\n    _aig_type: host\n',
+            'new_leaf.yml': '---\nnew_group:\n  vars:\n    new_var: included\n  host2:\n    _aig_type: host\n',
+        }, 'included'),
+        ('root file change', {
+            'inventory.yml': '---\ninclude_vars:\n  - vars.yml\nvars:\n  root_var: changed_root\nincludes:\n  - leaf.yml\n'
+                             'root_group:\n  host3:\n    _aig_type: host\n',
+        }, 'changed_root'),
+    )
+    for change_name, files, expected_value in changes:
+        commit_files(source_path, files, change_name)
+        # incremental_rebuild_verify fails the load when the rebuild differs from a full rebuild
+        load_log = ansible_inventory(config_paths['incremental'], env, '--list', '-vvvv')
+        if 'matches a full rebuild' not in load_log:
+            raise CheckFailed(f"the {change_name} was not rebuilt incrementally:\n{load_log}")
+        incremental_list = ansible_inventory(config_paths['incremental'], env, '--list')
+        if expected_value not in incremental_list:
+            raise CheckFailed(f"the {change_name} is missing from the rebuilt inventory:\n{incremental_list}")
+        full_list = ansible_inventory(config_paths['full'], env, '--list')
+        if incremental_list != full_list:
+            raise CheckFailed(f"the inventory rebuilt after the {change_name} differs from a full build:\n{incremental_list}\n{full_list}")
+
+
+@check
+def check_background_refresh_errors(work_dir, env):
+    ''' a failing background refresh is logged in the repository cache and shown by the next load at -vvvv '''
+    _, git_url = create_repository(work_dir, {'inventory.yml': '---\nvars:\n  refresh_var: first\nhost1:\n  _aig_type: host\n'})
+    repo_cache_dir = os.path.join(work_dir, 'repo-cache')
+    config_path = write_config(work_dir, 'inventory', {
+        'git_url': git_url,
+        'file_path': 'inventory.yml',
+        'git_repo_cache_dir': repo_cache_dir,
+        'git_repo_cache_update_time_seconds': 1,
+        'git_repo_cache_stale_while_revalidate': 'true',
+    })
+    ansible_inventory(config_path, env, '--list')
+    # the remote is gone, so every background refresh fails
+    os.rename(os.path.join(work_dir, 'inventory.git'), os.path.join(work_dir, 'moved.git'))
+    time.sleep(1.5)
+    ansible_inventory(config_path, env, '--list')
+    refresh_deadline = time.time() + 30
+    while not any(file_name.startswith('refresh-') and os.path.getsize(os.path.join(dir_path, file_name))
+                  for dir_path, _, file_names in os.walk(repo_cache_dir) for file_name in file_names):
+        if time.time() > refresh_deadline:
+            raise CheckFailed('the failed background refresh wrote no refresh log to the repository cache')
+        time.sleep(0.5)
+    load_log = ansible_inventory(config_path, env, '--list', '-vvvv')
+    if 'Last background refresh of repository cache' not in load_log:
+        raise CheckFailed(f"the failed background refresh was not shown at -vvvv:\n{load_log}")
+
+
+@check
+def check_compiled_inventory(work_dir, env):
+    ''' a compiled inventory loads the same inventory as the config it was compiled from, and uncompilable values are reported '''
+    _, git_url = create_repository(work_dir, {
+        'inventory.yml': '---\ninclude_vars:\n  - vars.yml\nvars:\n  root_var: root\n  root_dict:\n    nested: [1, 2]\n'
+                         'includes:\n  - datacenter.yml\n'
+                         'web:\n  vars:\n    ansible_group_priority: 5\n    web_var: web\n'
+                         '  web1:\n    _aig_type: host\n    vars:\n      host_var: web1\n',
+        'datacenter.yml': '---\ndc_web:\n  include_vars:\n    - dc_vars.yml\n  web1:\n    _aig_type: host\n  web2:\n    _aig_type: host\n',
+        'vars.yml': '---\nshared_var: shared\n',
+        # !vault values are only loaded from include_vars files
+        'dc_vars.yml': f"---\ndc_secret: {vault_value('dc secret', ' ' * 4)}",
+        'dates.yml': '---\ndated:\n  vars:\n    release_date: 2024-01-01\n  host1:\n    _aig_type: host\n',
+    })
+    built_config_path = write_config(work_dir, 'built', {
+        'git_url': git_url,
+        'file_path': 'inventory.yml',
+        'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+    })
+    compile_code, compile_output, compile_errors = run_cli(env, 'compile', built_config_path, '--output-dir', os.path.join(work_dir, 'compiled'))
+    if compile_code != 0:
+        raise CheckFailed(f"compile of {built_config_path} failed:\n{compile_errors}")
+    compiled_config_path = write_config(work_dir, 'compiled', {'compiled_inventory_path': compile_output.strip()})
+    for query_args in (('--list',), ('--host', 'web1'), ('--host', 'web2')):
+        built_output = ansible_inventory(built_config_path, env, *query_args)
+        compiled_output = ansible_inventory(compiled_config_path, env, *query_args)
+        if built_output != compiled_output:
+            raise CheckFailed(f"ansible-inventory {' '.join(query_args)} of the compiled inventory differs from the built inventory:\n"
+                              f"{compiled_output}\n{built_output}")
+    if '__ansible_vault' not in ansible_inventory(compiled_config_path, env, '--host', 'web2'):
+        raise CheckFailed('the !vault value of the compiled inventory is not a !vault value')
+    if find_in_files(os.path.join(work_dir, 'compiled'), 'dc secret'):
+        raise CheckFailed('the compiled inventory holds the decrypted !vault value')
+
+    compile_code, _, compile_errors = run_cli(env, 'compile', built_config_path, '--file-path', 'dates.yml',
+                                              '--output-dir', os.path.join(work_dir, 'compiled'))
+    if compile_code == 0 or 'Traceback' in compile_errors or 'release_date' not in compile_errors:
+        raise CheckFailed(f"compile of an inventory holding a date did not report the variable:\n{compile_errors}")
+
+
+@check
+def check_include_cycles(work_dir, env):
+    ''' an include cycle is reported the same with and without prefetch_workers, in both populate modes '''
+    _, git_url = create_repository(work_dir, {
+        'a.yml': '---\nincludes:\n  - sub/b.yml\ngroup_a:\n  host1:\n    _aig_type: host\n',
+        'sub/b.yml': '---\nincludes:\n  - ../a.yml\ngroup_b:\n  host2:\n    _aig_type: host\n',
+    })
+    for populate_mode in ('build', 'direct'):
+        for prefetch_workers in (0, 4):
+            config_path = write_config(work_dir, f"{populate_mode}-{prefetch_workers}", {
+                'git_url': git_url,
+                'file_path': 'a.yml',
+                'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+                'populate_mode': populate_mode,
+                'prefetch_workers': prefetch_workers,
+            })
+            try:
+                load_output = ansible_inventory(config_path, env, '--list')
+            except CheckFailed as e:
+                load_output = str(e)
+            else:
+                raise CheckFailed(f"the include cycle loaded with populate_mode {populate_mode} and prefetch_workers {prefetch_workers}:\n{load_output}")
+            if 'Inventory include cycle detected' not in load_output:
+                raise CheckFailed(f"the include cycle was not reported with populate_mode {populate_mode} and prefetch_workers {prefetch_workers}:\n"
+                                  f"{load_output}")
+
+
+@check
+def check_prefetch_matches_serial(work_dir, env):
+    ''' the inventory listed with prefetch_workers is the same as the inventory read one file at a time '''
+    _, git_url = create_repository(work_dir, {
+        'inventory.yml': '---\ninclude_vars:\n  - vars/shared.yml\nvars:\n  root_var: root\nincludes:\n  - dc1.yml\n  - dc2.yml\n',
+        # both datacenters include common.yml, which is not a cycle
+        'dc1.yml': '---\nincludes:\n  - common.yml\ndc1_web:\n  include_vars:\n    - vars/dc1.yml\n'
+                   '  web1:\n    _aig_type: host\n    vars:\n      host_var: dc1\n',
+        'dc2.yml': '---\nincludes:\n  - common.yml\ndc2_web:\n  include_vars:\n    - vars/shared.yml\n    - vars/dc2.yml\n'
+                   '  web1:\n    _aig_type: host\n  web2:\n    _aig_type: host\n',
+        'common.yml': '---\ncommon:\n  vars:\n    common_var: common\n  monitor1:\n    _aig_type: host\n',
+        'vars/shared.yml': f"---\nshared_var: shared\nshared_secret: {vault_value('shared secret', ' ' * 4)}",
+        'vars/dc1.yml': '---\ndc_var: dc1\nshared_var: dc1\n',
+        # vault encrypted as a whole, decrypted in vault_decrypt_workers processes when prefetching
+        'vars/dc2.yml': vault_encrypt('---\ndc_var: dc2\ndc2_secret: dc2 secret\n'),
+    })
+    for populate_mode in ('build', 'direct'):
+        inventory_lists = {}
+        for prefetch_workers, vault_decrypt_workers in ((0, 0), (4, 0), (4, 2)):
+            config_path = write_config(work_dir, f"{populate_mode}-{prefetch_workers}-{vault_decrypt_workers}", {
+                'git_url': git_url,
+                'file_path': 'inventory.yml',
+                'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+                'populate_mode': populate_mode,
+                'prefetch_workers': prefetch_workers,
+                'vault_decrypt_workers': vault_decrypt_workers,
+            })
+            inventory_lists[(prefetch_workers, vault_decrypt_workers)] = ansible_inventory(config_path, env, '--list')
+        if 'dc2 secret' not in inventory_lists[(0, 0)]:
+            raise CheckFailed(f"the vault encrypted vars/dc2.yml was not decrypted with populate_mode {populate_mode}:\n{inventory_lists[(0, 0)]}")
+        for workers, inventory_list in inventory_lists.items():
+            if inventory_list != inventory_lists[(0, 0)]:
+                raise CheckFailed(f"the inventory listed with populate_mode {populate_mode}, prefetch_workers and vault_decrypt_workers {workers} "
+                                  f"differs from the serial one:\n{inventory_list}\n{inventory_lists[(0, 0)]}")
+
+
+@check
+def check_vault_decrypt_workers_wrong_password(work_dir, env):
+    ''' a vault encrypted include_vars file that does not decrypt fails the load in vault_decrypt_workers as it does serially '''
+    _, git_url = create_repository(work_dir, {
+        'inventory.yml': '---\ninclude_vars:\n  - vars/secret.yml\nall_hosts:\n  web1:\n    _aig_type: host\n',
+        'vars/secret.yml': vault_encrypt('---\nsecret_var: secret\n'),
+    })
+    wrong_password_path = os.path.join(work_dir, 'wrong_password')
+    with open(wrong_password_path, 'w') as fh:
+        fh.write('wrong')
+    wrong_password_env = dict(env, ANSIBLE_VAULT_IDENTITY_LIST=f"{CHECKS_VAULT_ID}@{wrong_password_path}")
+    for prefetch_workers, vault_decrypt_workers in ((0, 0), (4, 2)):
+        config_path = write_config(work_dir, f"inventory-{prefetch_workers}-{vault_decrypt_workers}", {
+            'git_url': git_url,
+            'file_path': 'inventory.yml',
+            'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+            'prefetch_workers': prefetch_workers,
+            'vault_decrypt_workers': vault_decrypt_workers,
+        })
+        try:
+            load_output = ansible_inventory(config_path, wrong_password_env, '--list')
+        except CheckFailed as e:
+            load_output = str(e)
+        else:
+            raise CheckFailed(f"vars/secret.yml loaded with a wrong vault password, prefetch_workers {prefetch_workers} "
+                              f"and vault_decrypt_workers {vault_decrypt_workers}:\n{load_output}")
+        if 'Decryption failed' not in load_output:
+            raise CheckFailed(f"the vault decryption failure was not reported with prefetch_workers {prefetch_workers} "
+                              f"and vault_decrypt_workers {vault_decrypt_workers}:\n{load_output}")
+
+
+@check
+def check_direct_matches_build(work_dir, env):
+    ''' populate_mode direct lists the same inventory and group graph as populate_mode build when host groups are defined again '''
+    _, git_url = create_repository(work_dir, {
+        # x gives web1 v after its child group y does, x is first in group order so y wins
+        # a is defined again in more.yml after b gives web2 v, a is first in group order so b wins
+        # c links d, and more.yml links c from d, defining c again without d
+        # e is defined again inside itself, and e_child only exists through the first definition of e
+        'inventory.yml': '---\nx:\n  y:\n    web1:\n      _aig_type: host\n      vars:\n        v: y\n'
+                         '  web1:\n    _aig_type: host\n    vars:\n      v: x\n'
+                         'a:\n  vars:\n    a_var: first\n  a_child:\n  web2:\n    _aig_type: host\n    vars:\n      v: a1\n      a1_only: a1\n'
+                         '  web3:\n    _aig_type: host\n'
+                         'b:\n  web2:\n    _aig_type: host\n    vars:\n      v: b\n'
+                         'c:\n  d:\n    web4:\n      _aig_type: host\n'
+                         'e:\n  e_child:\n  e:\n    web5:\n      _aig_type: host\n'
+                         'includes:\n  - more.yml\n',
+        'more.yml': '---\nd:\n  c:\n    web4:\n      _aig_type: host\n'
+                    'a:\n  include_vars:\n    - vars/a.yml\n  web2:\n    _aig_type: host\n    vars:\n      v: a2\n',
+        'vars/a.yml': '---\na_var: last\n',
+    })
+    inventory_outputs = {}
+    for populate_mode in ('build', 'direct'):
+        config_path = write_config(work_dir, populate_mode, {
+            'git_url': git_url,
+            'file_path': 'inventory.yml',
+            'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+            'populate_mode': populate_mode,
+        })
+        inventory_outputs[populate_mode] = ansible_inventory(config_path, env, '--list') + ansible_inventory(config_path, env, '--graph', '--vars')
+    if inventory_outputs['direct'] != inventory_outputs['build']:
+        raise CheckFailed(f"the inventory listed with populate_mode direct differs from populate_mode build:\n"
+                          f"{inventory_outputs['direct']}\n{inventory_outputs['build']}")
+
+
+@check
+def check_query_commands(work_dir, env):
+    ''' the list and host commands output the same inventory and host variables as ansible-inventory --list and --host '''
+    # host1 is in a and b at the same depth, a wins by ansible_group_priority rather than by name,
+    # host3 is in b and c, c wins by name, shared is nested under mid and b, so at the depth of its deepest parent
+    write_files(os.path.join(work_dir, 'inventory'), {
+        'precedence.yml': '---\nvars:\n  order_var: root\n'
+                          'a:\n  vars:\n    ansible_group_priority: 10\n    order_var: a\n'
+                          '  mid:\n    vars:\n      order_var: mid\n      depth_var: mid\n'
+                          '    shared:\n      vars:\n        shared_var: shared\n      host2:\n        _aig_type: host\n'
+                          '  host1:\n    _aig_type: host\n'
+                          'b:\n  vars:\n    order_var: b\n    depth_var: b\n  shared:\n'
+                          '  host1:\n    _aig_type: host\n  host3:\n    _aig_type: host\n    vars:\n      host_var: host3\n'
+                          'c:\n  vars:\n    order_var: c\n  host3:\n    _aig_type: host\n',
+    })
+    examples_path = os.path.join(COLLECTION_PATH, 'examples', 'plugins', 'inventory', 'git')
+    example1_env = dict(env, ANSIBLE_VAULT_IDENTITY_LIST='dc1_cluster_secret@' + os.path.join(COLLECTION_PATH, 'tests', 'plugins', 'inventory',
+                                                                                              'git', 'avp_dc1_cluster_secret'))
+    for config_name, file_path, config_env in (('priority', os.path.join(work_dir, 'inventory', 'precedence.yml'), env),
+                                               ('example1', os.path.join(examples_path, 'example1.yml'), example1_env),
+                                               ('precedence', os.path.join(examples_path, 'precedence.yml'), env)):
+        config_path = write_config(work_dir, config_name, {'file_path': file_path})
+        ansible_list = json.loads(ansible_inventory(config_path, config_env, '--list'))
+        list_code, list_output, list_errors = run_cli(config_env, 'list', config_path)
+        if list_code != 0:
+            raise CheckFailed(f"list of {config_name} failed:\n{list_errors}")
+        if json.loads(list_output) != ansible_list:
+            raise CheckFailed(f"list of {config_name} differs from ansible-inventory --list:\n{list_output}\n{json.dumps(ansible_list, indent=4)}")
+        for host in sorted(ansible_list['_meta']['hostvars']):
+            ansible_host_vars = json.loads(ansible_inventory(config_path, config_env, '--host', host))
+            host_code, host_output, host_errors = run_cli(config_env, 'host', config_path, host)
+            if host_code != 0:
+                raise CheckFailed(f"host {host} of {config_name} failed:\n{host_errors}")
+            if json.loads(host_output) != ansible_host_vars:
+                raise CheckFailed(f"host {host} of {config_name} differs from ansible-inventory --host:\n"
+                                  f"{host_output}\n{json.dumps(ansible_host_vars, indent=4)}")
+
+
+def create_layout_repository(work_dir):
+    ''' a repository of LAYOUT_FILES with a second commit, allowing partial clone filters, returns its file:// url '''
+    source_path, git_url = create_repository(work_dir, LAYOUT_FILES)
+    commit_files(source_path, {'vars/shared.yml': '---\nshared_var: second_commit\n'}, 'second commit')
+    git(['config', 'uploadpack.allowFilter', 'true'], os.path.join(work_dir, 'inventory.git'))
+    return git_url
+
+
+def find_paths(path, name_suffix):
+    ''' files and directories under path with names ending in name_suffix '''
+    return [os.path.join(dir_path, found_name) for dir_path, dir_names, file_names in os.walk(path)
+            for found_name in dir_names + file_names if found_name.endswith(name_suffix)]
+
+
+@check
+def check_clone_options(work_dir, env):
+    ''' shallow, partial and sparse clones list the same inventory as a full clone, the sparse snapshot only holds what the inventory reads '''
+    git_url = create_layout_repository(work_dir)
+    variants = {
+        'full': {},
+        'depth': {'git_clone_depth': 1},
+        'filter': {'git_clone_filter': 'blob:none'},
+        'sparse': {'git_sparse_checkout': 'true'},
+        'all': {'git_clone_depth': 1, 'git_clone_filter': 'blob:none', 'git_sparse_checkout': 'true'},
+    }
+    inventory_lists = {}
+    for variant_name, options in variants.items():
+        config_path = write_config(work_dir, variant_name, dict({
+            'git_url': git_url,
+            'file_path': 'inventory.yml',
+            'git_repo_cache_dir': os.path.join(work_dir, f"repo-cache-{variant_name}"),
+        }, **options))
+        inventory_lists[variant_name] = ansible_inventory(config_path, env, '--list')
+        if inventory_lists[variant_name] != inventory_lists['full']:
+            raise CheckFailed(f"the {variant_name} clone lists a different inventory than a full clone:\n"
+                              f"{inventory_lists[variant_name]}\n{inventory_lists['full']}")
+    if 'second_commit' not in inventory_lists['full']:
+        raise CheckFailed(f"the inventory was not listed at the last commit:\n{inventory_lists['full']}")
+
+    for variant_name in ('depth', 'all'):
+        if not find_paths(os.path.join(work_dir, f"repo-cache-{variant_name}"), 'shallow'):
+            raise CheckFailed(f"the {variant_name} clone is not shallow")
+    for variant_name in ('filter', 'all'):
+        if not find_paths(os.path.join(work_dir, f"repo-cache-{variant_name}"), '.promisor'):
+            raise CheckFailed(f"the {variant_name} clone is not a partial clone")
+    for variant_name in ('sparse', 'all'):
+        snapshots_path = find_paths(os.path.join(work_dir, f"repo-cache-{variant_name}"), 'snapshots')[0]
+        for snapshot_name in os.listdir(snapshots_path):
+            snapshot_path = os.path.join(snapshots_path, snapshot_name)
+            if not os.path.isdir(snapshot_path):
+                continue
+            snapshot_dirs = sorted(name for name in os.listdir(snapshot_path) if os.path.isdir(os.path.join(snapshot_path, name)))
+            if snapshot_dirs != ['datacenters', 'vars']:
+                raise CheckFailed(f"the {variant_name} snapshot holds the directories {', '.join(snapshot_dirs)}, expected datacenters, vars")
+
+
+@check
+def check_objects_read_mode(work_dir, env):
+    ''' git_read_mode objects lists the same inventory as a checkout without any snapshot, for commits sharing one repository cache '''
+    git_url = create_layout_repository(work_dir)
+    first_commit_sha = git(['rev-parse', 'master~1'], os.path.join(work_dir, 'source')).strip()
+    for commit in ('master', first_commit_sha):
+        inventory_lists = {}
+        for variant_name, options in (('checkout', {}), ('objects', {'git_read_mode': 'objects'}),
+                                      ('objects-filter', {'git_read_mode': 'objects', 'git_clone_filter': 'blob:none'})):
+            # the objects configs of both commits share one repository cache
+            config_path = write_config(work_dir, f"{variant_name}-{commit}", dict({
+                'git_url': git_url,
+                'commit': commit,
+                'file_path': 'inventory.yml',
+                'git_repo_cache_dir': os.path.join(work_dir, f"repo-cache-{variant_name}"),
+            }, **options))
+            inventory_lists[variant_name] = ansible_inventory(config_path, env, '--list')
+            if inventory_lists[variant_name] != inventory_lists['checkout']:
+                raise CheckFailed(f"git_read_mode {variant_name} at {commit} lists a different inventory than a checkout:\n"
+                                  f"{inventory_lists[variant_name]}\n{inventory_lists['checkout']}")
+        expected_value = 'second_commit' if commit == 'master' else 'shared_var": "shared'
+        if expected_value not in inventory_lists['checkout']:
+            raise CheckFailed(f"the inventory was not listed at {commit}:\n{inventory_lists['checkout']}")
+    for variant_name in ('objects', 'objects-filter'):
+        if find_paths(os.path.join(work_dir, f"repo-cache-{variant_name}"), 'snapshots'):
+            raise CheckFailed(f"git_read_mode {variant_name} checked out a snapshot")
+
+
+@check
+def check_sources(work_dir, env):
+    ''' a group or host variable set by several sources takes the value of the last source listed, at the commit of each source '''
+    git_urls = {}
+    for source_name in ('first', 'second'):
+        source_work_dir = os.path.join(work_dir, source_name)
+        source_path, git_urls[source_name] = create_repository(source_work_dir, {
+            'site.yml': f"---\nweb:\n  vars:\n    group_var: {source_name}\n"
+                        f"  web1:\n    _aig_type: host\n    vars:\n      host_var: {source_name}\n",
+        })
+        # the default commit of both sources is master, dev is only listed by a source setting its own commit
+        commit_files(source_path, {
+            'site.yml': f"---\nweb:\n  vars:\n    group_var: {source_name}_dev\n"
+                        f"  web1:\n    _aig_type: host\n    vars:\n      host_var: {source_name}_dev\n",
+        }, 'dev branch', branch='dev')
+    source_listings = (
+        ([('first', None), ('second', None)], 'second', 'second'),
+        ([('second', None), ('first', None)], 'first', 'first'),
+        ([('first', None), ('second', 'dev')], 'second_dev', 'second_dev'),
+        ([('first', 'dev'), ('second', None)], 'second', 'second'),
+    )
+    for config_index, (listed_sources, expected_group_var, expected_host_var) in enumerate(source_listings):
+        sources = []
+        for source_name, commit in listed_sources:
+            source = {'git_url': git_urls[source_name], 'file_path': 'site.yml'}
+            if commit is not None:
+                source['commit'] = commit
+            sources.append(source)
+        # a JSON list is a YAML flow sequence
+        config_path = write_config(work_dir, f"sources-{config_index}", {
+            'sources': json.dumps(sources),
+            'git_repo_cache_dir': os.path.join(work_dir, 'repo-cache'),
+        })
+        host_vars = json.loads(ansible_inventory(config_path, env, '--host', 'web1'))
+        if host_vars.get('group_var') != expected_group_var or host_vars.get('host_var') != expected_host_var:
+            raise CheckFailed(f"sources {listed_sources} set group_var {host_vars.get('group_var')} and host_var {host_vars.get('host_var')}, "
+                              f"expected {expected_group_var} and {expected_host_var}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the spatiumcepa.platform.git inventory plugin against local git repositories')
+    parser.add_argument('--check', action='append', choices=sorted(CHECKS), help='check to run, may be given more than once, all checks by default')
+    parser.add_argument('--work-dir', help='directory for generated repositories and caches, a temporary directory by default')
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='inventory-git-checks-')
+    os.makedirs(work_dir, exist_ok=True)
+    failed_checks = []
+    try:
+        # make this collection checkout importable as spatiumcepa.platform
+        collections_path = os.path.join(work_dir, 'collections')
+        os.makedirs(os.path.join(collections_path, 'ansible_collections', 'spatiumcepa'), exist_ok=True)
+        collection_link = os.path.join(collections_path, 'ansible_collections', 'spatiumcepa', 'platform')
+        if not os.path.exists(collection_link):
+            os.symlink(COLLECTION_PATH, collection_link)
+        vault_password_path = os.path.join(work_dir, 'vault_password')
+        with open(vault_password_path, 'w') as fh:
+            fh.write(CHECKS_VAULT_PASSWORD)
+        env = dict(os.environ, ANSIBLE_COLLECTIONS_PATH=collections_path,
+                   ANSIBLE_INVENTORY_ENABLED='spatiumcepa.platform.git', ANSIBLE_INVENTORY_ANY_UNPARSED_IS_FAILED='True',
+                   ANSIBLE_VAULT_IDENTITY_LIST=f"{CHECKS_VAULT_ID}@{vault_password_path}")
+
+        for check_name in args.check or sorted(CHECKS):
+            check_work_dir = os.path.join(work_dir, check_name)
+            os.makedirs(check_work_dir)
+            try:
+                CHECKS[check_name](check_work_dir, env)
+            except CheckFailed as e:
+                failed_checks.append(check_name)
+                print(f"FAIL {check_name}: {e}")
+            else:
+                print(f"ok {check_name}")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+    if failed_checks:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()